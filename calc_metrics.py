@@ -58,13 +58,12 @@ def subprocess_fn(rank, args, temp_dir):
         c = torch.empty([1, G.c_dim], device=device)
         misc.print_module_summary(G, [z, c])
 
-    # Calculate each metric.
-    for metric in args.metrics:
-        if rank == 0 and args.verbose:
-            print(f'Calculating {metric}...')
-        progress = metric_utils.ProgressMonitor(verbose=args.verbose)
-        result_dict = metric_main.calc_metric(metric=metric, G=G, dataset_kwargs=args.dataset_kwargs,
-            num_gpus=args.num_gpus, rank=rank, device=device, progress=progress)
+    # Calculate all metrics, sharing the generator passes between them.
+    if rank == 0 and args.verbose:
+        print(f'Calculating {", ".join(args.metrics)}...')
+    progress = metric_utils.ProgressMonitor(verbose=args.verbose)
+    for result_dict in metric_main.calc_metrics(metrics=args.metrics, G=G, dataset_kwargs=args.dataset_kwargs,
+        num_gpus=args.num_gpus, rank=rank, device=device, progress=progress):
         if rank == 0:
             metric_main.report_metric(result_dict, run_dir=args.run_dir, snapshot_pkl=args.network_pkl)
         if rank == 0 and args.verbose:
@@ -112,6 +111,7 @@ def calc_metrics(ctx, network_pkl, metrics, data, mirror, gpus, verbose):
     \b
     Recommended metrics:
       fid50k_full  Frechet inception distance against the full dataset.
+      fid50k_seq   Like fid50k_full, but stops early once the estimate is precise enough.
       kid50k_full  Kernel inception distance against the full dataset.
       pr50k3_full  Precision and recall againt the full dataset.
       ppl2_wend    Perceptual path length in W, endpoints, full image.
@@ -0,0 +1,137 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Check that the channels_last memory format (--cl) produces the same
+results as the default contiguous format, for the reference
+implementations of the custom ops as well as for G and D."""
+
+import click
+import torch
+
+from torch_utils import misc
+from torch_utils.ops import upfirdn2d
+from torch_utils.ops import bias_act
+from torch_utils.ops import filtered_lrelu
+from training import networks_stylegan2
+from training import networks_stylegan3
+
+#----------------------------------------------------------------------------
+
+def max_rel_diff(a, b):
+    return float((a - b).abs().max() / b.abs().max().clamp(min=1e-8))
+
+def to_format(x, channels_last):
+    return x.contiguous(memory_format=(torch.channels_last if channels_last else torch.contiguous_format))
+
+#----------------------------------------------------------------------------
+# Reference ops: outputs, first-order gradients, and second-order gradients
+# w.r.t. the input, evaluated on the same values in both memory formats.
+
+def check_ops(device):
+    torch.manual_seed(0)
+    x = torch.randn([2, 8, 9, 11], device=device)
+    f = upfirdn2d.setup_filter([1,3,3,1], device=device)
+    b = torch.randn([8], device=device)
+    fu = torch.randn([12], device=device)
+    fd = torch.randn([12], device=device)
+    ops = []
+    for up, down, padding in [(1,1,0), (2,1,[2,1,2,1]), (1,2,1), (2,2,[3,2,-1,1]), (4,1,0)]:
+        ops.append((f'upfirdn2d up={up} down={down}', lambda t, up=up, down=down, padding=padding: upfirdn2d.upfirdn2d(t, f, up=up, down=down, padding=padding, impl='ref')))
+    for act in ['linear', 'lrelu', 'relu', 'swish']:
+        ops.append((f'bias_act act={act}', lambda t, act=act: bias_act.bias_act(t, b, act=act, clamp=1.0, impl='ref')))
+    ops.append(('filtered_lrelu up=2 down=2', lambda t: filtered_lrelu.filtered_lrelu(t, fu, fd, b, up=2, down=2, padding=10, clamp=256, impl='ref')))
+
+    for name, fn in ops:
+        results = []
+        for channels_last in [False, True]:
+            xx = to_format(x, channels_last).requires_grad_(True)
+            y = fn(xx)
+            g, = torch.autograd.grad(y.square().sum(), xx, create_graph=True)
+            gg, = torch.autograd.grad(g.square().sum(), xx)
+            results.append([y.detach(), g.detach(), gg])
+        yield name, max(max_rel_diff(a, b) for a, b in zip(results[1], results[0]))
+
+#----------------------------------------------------------------------------
+# Networks: outputs and parameter gradients of G, and outputs, R1 gradients,
+# and parameter gradients of the R1 penalty for D, with identical weights.
+
+def check_networks(device):
+    common = dict(img_resolution=32, img_channels=3, channel_base=1024, channel_max=32)
+    G_kwargs = dict(z_dim=32, c_dim=0, w_dim=32, **common)
+    def param_grad_diff(nets):
+        pairs = zip(nets[1].parameters(), nets[0].parameters())
+        return max(max_rel_diff(a.grad, b.grad) for a, b in pairs if b.grad is not None)
+
+    for name, cls, kwargs in [
+        ('G stylegan2',         networks_stylegan2.Generator, dict()),
+        ('G stylegan2 resnet',  networks_stylegan2.Generator, dict(architecture='resnet')),
+        ('G stylegan3-t',       networks_stylegan3.Generator, dict()),
+        ('G stylegan3-r',       networks_stylegan3.Generator, dict(conv_kernel=1, use_radial_filters=True)),
+    ]:
+        torch.manual_seed(0)
+        z = torch.randn([4, G_kwargs['z_dim']], device=device)
+        nets, outputs = [], []
+        for channels_last in [False, True]:
+            G = cls(channels_last=channels_last, **G_kwargs, **kwargs).train().requires_grad_(True).to(device)
+            if len(nets) > 0:
+                with torch.no_grad():
+                    misc.copy_params_and_buffers(nets[0], G, require_all=True)
+            img = G(z, None, noise_mode='const')
+            img.square().sum().backward()
+            nets.append(G)
+            outputs.append(img.detach())
+        yield name, max(max_rel_diff(outputs[1], outputs[0]), param_grad_diff(nets))
+
+    torch.manual_seed(0)
+    img = torch.randn([4, 3, 32, 32], device=device)
+    nets, results = [], []
+    for channels_last in [False, True]:
+        D = networks_stylegan2.Discriminator(c_dim=0, block_kwargs=dict(channels_last=channels_last), **common).train().requires_grad_(True).to(device)
+        if len(nets) > 0:
+            with torch.no_grad():
+                misc.copy_params_and_buffers(nets[0], D, require_all=True)
+        x = img.detach().requires_grad_(True)
+        logits = D(x, None)
+        r1_grads, = torch.autograd.grad(logits.sum(), x, create_graph=True)
+        r1_grads.square().sum().backward()
+        nets.append(D)
+        results.append([logits.detach(), r1_grads.detach()])
+    yield 'D stylegan2', max(max(max_rel_diff(a, b) for a, b in zip(results[1], results[0])), param_grad_diff(nets))
+
+#----------------------------------------------------------------------------
+
+@click.command()
+@click.option('--device', help='Device to run the checks on', metavar='STR', default='cpu', show_default=True)
+@click.option('--tol',    help='Maximum relative difference', metavar='FLOAT', type=click.FloatRange(min=0), default=1e-4, show_default=True)
+def main(device, tol):
+    """Compare channels_last against contiguous results.
+
+    Exits with an error if any relative difference exceeds --tol.
+
+    Examples:
+
+    \b
+    # Check the reference ops and the networks on the CPU.
+    python check_channels_last.py
+    """
+    device = torch.device(device)
+    failed = []
+    for name, diff in [*check_ops(device), *check_networks(device)]:
+        ok = (diff <= tol)
+        print(f'{name:<30s} max rel diff {diff:.2e}  {"ok" if ok else "FAILED"}')
+        if not ok:
+            failed.append(name)
+    if len(failed) > 0:
+        raise click.ClickException(f'{len(failed)} check(s) exceeded --tol={tol:g}: {", ".join(failed)}')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,84 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Check that packed runs (--pack-*) write the same statistics schema to
+their stats.jsonl as an unpacked run, regardless of the number of runs."""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import click
+
+#----------------------------------------------------------------------------
+
+def read_stats_keys(stats_file):
+    keys = set()
+    with open(stats_file, 'rt') as f:
+        for line in f:
+            keys.update(json.loads(line).keys())
+    return keys
+
+def train(outdir, desc, args):
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train.py'), f'--outdir={outdir}', f'--desc={desc}', *args]
+    print(' '.join(cmd))
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    run_dir, = glob.glob(os.path.join(outdir, f'*-{desc}'))
+    return run_dir
+
+#----------------------------------------------------------------------------
+
+@click.command(context_settings=dict(ignore_unknown_options=True))
+@click.option('--outdir', help='Where to save the training runs [default: temporary directory]', metavar='DIR')
+@click.argument('train_args', nargs=-1, type=click.UNPROCESSED)
+def main(outdir, train_args):
+    """Train for one tick unpacked, with one packed run, and with two packed
+    runs, and compare the keys written to the stats.jsonl of every run.
+
+    All arguments after `--` are passed to train.py, and must include at
+    least --data, --cfg, --gpus, --batch, and --gamma.
+
+    Examples:
+
+    \b
+    python check_packed_stats.py -- --data=~/datasets/ffhq-64x64.zip \\
+        --cfg=stylegan2 --gpus=1 --batch=16 --gamma=1 --cbase=1024 --cmax=32
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outdir = outdir if outdir is not None else tmpdir
+        args = [*train_args, '--kimg=1', '--tick=1', '--snap=1', '--metrics=none']
+        schemas = dict()
+        run_dir = train(outdir, 'unpacked', args)
+        schemas['unpacked'] = read_stats_keys(os.path.join(run_dir, 'stats.jsonl'))
+        for desc, pack in [('pack1', '--pack-gamma=5'), ('pack2', '--pack-gamma=1,2')]:
+            run_dir = train(outdir, desc, [*args, pack])
+            for stats_file in sorted(glob.glob(os.path.join(run_dir, 'run*', 'stats.jsonl'))):
+                schemas[f'{desc}/{os.path.basename(os.path.dirname(stats_file))}'] = read_stats_keys(stats_file)
+
+        ref = schemas['unpacked']
+        failed = []
+        for name, keys in schemas.items():
+            ok = (keys == ref)
+            print(f'{name:<24s} {len(keys):3d} keys  {"ok" if ok else "MISMATCH"}')
+            if not ok:
+                print(f'    missing: {sorted(ref - keys)}')
+                print(f'    extra:   {sorted(keys - ref)}')
+                failed.append(name)
+        if len(schemas) != 4:
+            raise click.ClickException(f'Expected 4 stats.jsonl files, found {len(schemas)}')
+        if len(failed) > 0:
+            raise click.ClickException(f'stats.jsonl schema differs from the unpacked run for: {", ".join(failed)}')
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main() # pylint: disable=no-value-for-parameter
+
+#----------------------------------------------------------------------------
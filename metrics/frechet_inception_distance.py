@@ -13,6 +13,7 @@ https://github.com/bioinf-jku/TTUR/blob/master/fid.py"""
 
 import numpy as np
 import scipy.linalg
+import torch
 from . import metric_utils
 
 #----------------------------------------------------------------------------
@@ -32,10 +33,139 @@ def compute_fid(opts, max_real, num_gen):
 
     if opts.rank != 0:
         return float('nan')
+    return calc_fid(mu_gen, sigma_gen, mu_real, sigma_real, device=opts.device)
 
+#----------------------------------------------------------------------------
+
+# The trace of sqrtm(sigma_gen @ sigma_real) equals the sum of the square
+# roots of the eigenvalues of the symmetric PSD matrix A @ sigma_gen @ A,
+# where A = sqrtm(sigma_real), since the two products share their
+# eigenvalues. Two symmetric eigendecompositions are considerably faster
+# than the Schur-based scipy.linalg.sqrtm and never produce complex noise.
+# Pass `device` to run them in float64 on the GPU, and `sqrt_sigma_real`
+# to reuse A across calls. impl='scipy' selects the reference method.
+
+def calc_fid(mu_gen, sigma_gen, mu_real, sigma_real, impl='eigh', device=None, sqrt_sigma_real=None):
     m = np.square(mu_gen - mu_real).sum()
-    s, _ = scipy.linalg.sqrtm(np.dot(sigma_gen, sigma_real), disp=False) # pylint: disable=no-member
-    fid = np.real(m + np.trace(sigma_gen + sigma_real - s * 2))
+    if impl == 'scipy':
+        s, _ = scipy.linalg.sqrtm(np.dot(sigma_gen, sigma_real), disp=False) # pylint: disable=no-member
+        trace_sqrt = np.real(np.trace(s))
+    else:
+        assert impl == 'eigh'
+        if sqrt_sigma_real is None:
+            sqrt_sigma_real = calc_sqrtm_psd(sigma_real, device=device)
+        a = torch.as_tensor(sqrt_sigma_real, dtype=torch.float64, device=device)
+        b = torch.as_tensor(sigma_gen, dtype=torch.float64, device=device)
+        p = a @ b @ a
+        eigvals = torch.linalg.eigvalsh((p + p.T) / 2)
+        trace_sqrt = float(eigvals.clamp(min=0).sqrt().sum().cpu())
+    fid = np.real(m + np.trace(sigma_gen) + np.trace(sigma_real) - trace_sqrt * 2)
     return float(fid)
 
+def calc_sqrtm_psd(sigma, device=None):
+    sigma = torch.as_tensor(sigma, dtype=torch.float64, device=device)
+    eigvals, eigvecs = torch.linalg.eigh((sigma + sigma.T) / 2)
+    return (eigvecs * eigvals.clamp(min=0).sqrt()) @ eigvecs.T
+
+#----------------------------------------------------------------------------
+# Sequential variant that stops generating images once the FID is known
+# precisely enough, e.g. for ranking snapshots during training. The
+# generated features are accumulated into `num_groups` interleaved groups,
+# and every `check_every` images the standard error is estimated with a
+# delete-one-group jackknife. Generation stops once the half-width of the
+# 95% confidence interval is below `rel_ci` times the estimate, or after
+# `max_gen` images. Note that FID is biased upwards for small sample
+# counts, so estimates based on different numbers of images are not
+# strictly comparable. Returns (fid, standard error, number of images).
+
+def compute_fid_sequential(opts, max_real, max_gen, min_gen=10000, check_every=5000, num_groups=8, rel_ci=0.01, batch_size=64):
+    detector_url = 'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan3/versions/1/files/metrics/inception-2015-12-05.pkl'
+    detector_kwargs = dict(return_features=True) # Return raw features before the softmax layer.
+    assert num_groups >= 2
+
+    mu_real, sigma_real = metric_utils.compute_feature_stats_for_dataset(
+        opts=opts, detector_url=detector_url, detector_kwargs=detector_kwargs,
+        rel_lo=0, rel_hi=0, capture_mean_cov=True, max_items=max_real).get_mean_cov()
+
+    progress = opts.progress.sub(tag='generator features', num_items=max_gen, rel_lo=0, rel_hi=1)
+    detector = metric_utils.get_feature_detector(url=detector_url, device=opts.device, num_gpus=opts.num_gpus, rank=opts.rank, verbose=progress.verbose)
+    groups = [metric_utils.FeatureStats(capture_mean_cov=True) for _group_idx in range(num_groups)]
+    fid = se = float('nan')
+    num_items = 0
+    next_check = max(min_gen, check_every)
+    for batch_idx, images in enumerate(metric_utils.iterate_generated_images(opts=opts, batch_size=batch_size)):
+        features = detector(images, **detector_kwargs)
+        group = groups[batch_idx % num_groups]
+        group.max_items = group.num_items + max_gen - num_items # truncate the last batch to max_gen in total
+        group.append_torch(features, num_gpus=opts.num_gpus, rank=opts.rank)
+        num_items = sum(group.num_items for group in groups)
+        progress.update(min(num_items, max_gen))
+        if num_items < min(next_check, max_gen):
+            continue
+        next_check = (num_items // check_every + 1) * check_every
+
+        # Estimate FID and its standard error on rank 0, and agree on whether to stop.
+        done = (num_items >= max_gen)
+        if opts.rank == 0:
+            fid, se = _calc_fid_jackknife(groups, mu_real, sigma_real, device=opts.device)
+            done = done or (1.96 * se <= rel_ci * fid)
+        if opts.num_gpus > 1:
+            flag = torch.as_tensor(float(done), dtype=torch.float32, device=opts.device)
+            torch.distributed.broadcast(flag, src=0)
+            done = (float(flag.cpu()) != 0)
+        if done:
+            break
+
+    if opts.rank != 0:
+        return float('nan'), float('nan'), num_items
+    return fid, se, num_items
+
+def _calc_fid_jackknife(groups, mu_real, sigma_real, device=None):
+    def get_mean_cov(num_items, raw_mean, raw_cov):
+        mean = raw_mean / num_items
+        return mean, raw_cov / num_items - np.outer(mean, mean)
+    def calc(num_items, raw_mean, raw_cov):
+        return calc_fid(*get_mean_cov(num_items, raw_mean, raw_cov), mu_real, sigma_real, device=device, sqrt_sigma_real=sqrt_sigma_real)
+    sqrt_sigma_real = calc_sqrtm_psd(sigma_real, device=device)
+    total = [sum(getattr(group, name) for group in groups if group.num_items > 0) for name in ['num_items', 'raw_mean', 'raw_cov']]
+    fid = calc(*total)
+    if any(group.num_items == 0 for group in groups):
+        return fid, float('inf')
+    loo = [calc(total[0] - group.num_items, total[1] - group.raw_mean, total[2] - group.raw_cov) for group in groups]
+    k = len(groups)
+    se = np.sqrt((k - 1) / k * np.square(np.asarray(loo) - np.mean(loo)).sum())
+    return fid, float(se)
+
+#----------------------------------------------------------------------------
+# Tolerance check of impl='eigh' against impl='scipy' on random covariances,
+# including rank-deficient ones estimated from fewer samples than features.
+# Usage: python -m metrics.frechet_inception_distance [num_features] [device]
+
+def _check_calc_fid(num_features=2048, device=None, rtol=1e-5, seed=0):
+    import time
+    rnd = np.random.RandomState(seed)
+    mix = rnd.randn(num_features, num_features) / np.sqrt(num_features)
+    failed = []
+    for num_real, num_gen in [(num_features * 4, num_features * 4), (num_features * 4, num_features // 2), (num_features // 2, num_features // 4)]:
+        real = rnd.randn(num_real, num_features) @ mix
+        gen = rnd.randn(num_gen, num_features) @ (mix * 1.1) + rnd.randn(num_features) * 0.1
+        stats = [real.mean(axis=0), np.cov(real, rowvar=False), gen.mean(axis=0), np.cov(gen, rowvar=False)]
+        mu_real, sigma_real, mu_gen, sigma_gen = stats
+        results = []
+        for impl in ['scipy', 'eigh']:
+            start = time.time()
+            results.append(calc_fid(mu_gen, sigma_gen, mu_real, sigma_real, impl=impl, device=device))
+            results.append(time.time() - start)
+        ref, ref_time, fid, fid_time = results
+        rel_diff = abs(fid - ref) / abs(ref)
+        print(f'real {num_real:<6d} gen {num_gen:<6d} scipy {ref:<12.6f} ({ref_time:.2f}s)  eigh {fid:<12.6f} ({fid_time:.2f}s)  rel diff {rel_diff:.2e}')
+        if not rel_diff <= rtol:
+            failed.append((num_real, num_gen))
+    if len(failed) > 0:
+        raise SystemExit(f'calc_fid(impl="eigh") differs from scipy by more than rtol={rtol:g} for (num_real, num_gen) = {failed}')
+
+if __name__ == "__main__":
+    import sys
+    _check_calc_fid(num_features=(int(sys.argv[1]) if len(sys.argv) > 1 else 2048), device=(sys.argv[2] if len(sys.argv) > 2 else None))
+
 #----------------------------------------------------------------------------
@@ -67,6 +67,60 @@ def calc_metric(metric, **kwargs): # See metric_utils.MetricOptions for the full
 
 #----------------------------------------------------------------------------
 
+def calc_metrics(metrics, **kwargs): # See metric_utils.MetricOptions for the full list of arguments.
+    r"""Calculates several metrics like calc_metric(), but runs the generator
+    only once for all metrics that consume generator features of the same
+    sample count, feeding each image batch to every detector they need.
+    Returns a list of result dicts, one per metric."""
+    assert all(is_valid_metric(metric) for metric in metrics)
+
+    # Plan: group the requested generator features by sample count, dataset view, and detector.
+    groups = dict() # (num_gen, dataset view) => (dataset_kwargs, {key: request})
+    num_users = dict() # key => number of requested metrics using it
+    for metric in metrics:
+        dataset_kwargs = _get_gen_dataset_kwargs(metric, kwargs)
+        for detector_url, detector_kwargs, num_gen, capture in _gen_features.get(metric, []):
+            key = metric_utils.get_gen_features_key(detector_url, detector_kwargs, num_gen, dataset_kwargs)
+            requests = groups.setdefault((num_gen, repr(sorted(dataset_kwargs.items()))), (dataset_kwargs, dict()))[1]
+            request = requests.setdefault(key, dnnlib.EasyDict(
+                detector_url=detector_url, detector_kwargs=detector_kwargs, stats_kwargs=dict(max_items=num_gen)))
+            request.stats_kwargs[capture] = True
+            num_users[key] = num_users.get(key, 0) + 1
+
+    # Run the shared generator passes, skipping those that would serve only one metric.
+    start_time = time.time()
+    gen_features = dict()
+    for dataset_kwargs, requests in groups.values():
+        if sum(num_users[key] for key in requests) >= 2:
+            opts = metric_utils.MetricOptions(**dict(kwargs, dataset_kwargs=dataset_kwargs))
+            stats_list = metric_utils.compute_feature_stats_for_generator_multi(opts, list(requests.values()))
+            gen_features.update(zip(requests.keys(), stats_list))
+    shared_time = time.time() - start_time
+
+    # Evaluate each metric from the shared features, releasing them after their last use.
+    sharing = [metric for metric in metrics if any(key in gen_features for key in _get_gen_features_keys(metric, kwargs))]
+    results = []
+    for metric in metrics:
+        result_dict = calc_metric(metric=metric, gen_features=gen_features, **kwargs)
+        if metric in sharing: # Attribute an equal share of the shared passes to each metric.
+            result_dict.total_time += shared_time / len(sharing)
+            result_dict.total_time_str = dnnlib.util.format_time(result_dict.total_time)
+        results.append(result_dict)
+        for key in _get_gen_features_keys(metric, kwargs):
+            num_users[key] -= 1
+            if num_users[key] == 0:
+                gen_features.pop(key, None)
+    return results
+
+def _get_gen_dataset_kwargs(metric, kwargs):
+    return dnnlib.EasyDict(kwargs.get('dataset_kwargs', {}), **_gen_dataset_kwargs.get(metric, {}))
+
+def _get_gen_features_keys(metric, kwargs):
+    dataset_kwargs = _get_gen_dataset_kwargs(metric, kwargs)
+    return [metric_utils.get_gen_features_key(url, detector_kwargs, num_gen, dataset_kwargs) for url, detector_kwargs, num_gen, _capture in _gen_features.get(metric, [])]
+
+#----------------------------------------------------------------------------
+
 def report_metric(result_dict, run_dir=None, snapshot_pkl=None):
     metric = result_dict['metric']
     assert is_valid_metric(metric)
@@ -88,6 +142,12 @@ def fid50k_full(opts):
     fid = frechet_inception_distance.compute_fid(opts, max_real=None, num_gen=50000)
     return dict(fid50k_full=fid)
 
+@register_metric
+def fid50k_seq(opts):
+    opts.dataset_kwargs.update(max_size=None, xflip=False)
+    fid, se, num_gen = frechet_inception_distance.compute_fid_sequential(opts, max_real=None, max_gen=50000)
+    return dict(fid50k_seq=fid, fid50k_seq_se=se, fid50k_seq_num_gen=num_gen)
+
 @register_metric
 def kid50k_full(opts):
     opts.dataset_kwargs.update(max_size=None, xflip=False)
@@ -151,3 +211,32 @@ def is50k(opts):
     return dict(is50k_mean=mean, is50k_std=std)
 
 #----------------------------------------------------------------------------
+# Generator features consumed by each metric, as (detector_url, detector_kwargs,
+# num_gen, capture), where capture is the FeatureStats option the metric needs,
+# and the updates each metric applies to dataset_kwargs, which determine the
+# labels fed to the generator. Must match the metric implementations;
+# calc_metrics() uses them to share one generator pass between metrics.
+
+_inception_url = 'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan3/versions/1/files/metrics/inception-2015-12-05.pkl'
+_vgg16_url = 'https://api.ngc.nvidia.com/v2/models/nvidia/research/stylegan3/versions/1/files/metrics/vgg16.pkl'
+_gen_features = dict(
+    fid50k_full = [(_inception_url, dict(return_features=True), 50000, 'capture_mean_cov')],
+    kid50k_full = [(_inception_url, dict(return_features=True), 50000, 'capture_all')],
+    pr50k3_full = [(_vgg16_url, dict(return_features=True), 50000, 'capture_all')],
+    fid50k      = [(_inception_url, dict(return_features=True), 50000, 'capture_mean_cov')],
+    kid50k      = [(_inception_url, dict(return_features=True), 50000, 'capture_all')],
+    pr50k3      = [(_vgg16_url, dict(return_features=True), 50000, 'capture_all')],
+    is50k       = [(_inception_url, dict(no_output_bias=True), 50000, 'capture_all')],
+)
+
+_gen_dataset_kwargs = dict(
+    fid50k_full = dict(max_size=None, xflip=False),
+    kid50k_full = dict(max_size=None, xflip=False),
+    pr50k3_full = dict(max_size=None, xflip=False),
+    fid50k      = dict(max_size=None),
+    kid50k      = dict(max_size=None),
+    pr50k3      = dict(max_size=None),
+    is50k       = dict(max_size=None, xflip=False),
+)
+
+#----------------------------------------------------------------------------
@@ -21,7 +21,7 @@ import dnnlib
 #----------------------------------------------------------------------------
 
 class MetricOptions:
-    def __init__(self, G=None, G_kwargs={}, dataset_kwargs={}, num_gpus=1, rank=0, device=None, progress=None, cache=True):
+    def __init__(self, G=None, G_kwargs={}, dataset_kwargs={}, num_gpus=1, rank=0, device=None, progress=None, cache=True, gen_features=None):
         assert 0 <= rank < num_gpus
         self.G              = G
         self.G_kwargs       = dnnlib.EasyDict(G_kwargs)
@@ -31,6 +31,7 @@ class MetricOptions:
         self.device         = device if device is not None else torch.device('cuda', rank)
         self.progress       = progress.sub() if progress is not None and rank == 0 else ProgressMonitor()
         self.cache          = cache
+        self.gen_features   = gen_features if gen_features is not None else dict() # Precomputed generator features, see metric_main.calc_metrics().
 
 #----------------------------------------------------------------------------
 
@@ -63,7 +64,8 @@ def iterate_random_labels(opts, batch_size):
         dataset = dnnlib.util.construct_class_by_name(**opts.dataset_kwargs)
         while True:
             c = [dataset.get_label(np.random.randint(len(dataset))) for _i in range(batch_size)]
-            c = torch.from_numpy(np.stack(c)).pin_memory().to(opts.device)
+            c = torch.from_numpy(np.stack(c))
+            c = (c.pin_memory() if opts.device.type == 'cuda' else c).to(opts.device)
             yield c
 
 #----------------------------------------------------------------------------
@@ -207,11 +209,11 @@ def compute_feature_stats_for_dataset(opts, detector_url, detector_kwargs, rel_l
         cache_tag = f'{dataset.name}-{get_feature_detector_name(detector_url)}-{md5.hexdigest()}'
         cache_file = dnnlib.make_cache_dir_path('gan-metrics', cache_tag + '.pkl')
 
-        # Check if the file exists (all processes must agree).
-        flag = os.path.isfile(cache_file) if opts.rank == 0 else False
+        # Check if the file exists (all processes must agree, even if the nodes do not share a file system).
+        flag = os.path.isfile(cache_file)
         if opts.num_gpus > 1:
             flag = torch.as_tensor(flag, dtype=torch.float32, device=opts.device)
-            torch.distributed.broadcast(tensor=flag, src=0)
+            torch.distributed.all_reduce(tensor=flag, op=torch.distributed.ReduceOp.MIN)
             flag = (float(flag.cpu()) != 0)
 
         # Load.
@@ -244,8 +246,10 @@ def compute_feature_stats_for_dataset(opts, detector_url, detector_kwargs, rel_l
     return stats
 
 #----------------------------------------------------------------------------
+# Yields batches of random uint8 images from opts.G, with 3 color channels,
+# indefinitely.
 
-def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel_lo=0, rel_hi=1, batch_size=64, batch_gen=None, **stats_kwargs):
+def iterate_generated_images(opts, batch_size=64, batch_gen=None):
     if batch_gen is None:
         batch_gen = min(batch_size, 4)
     assert batch_size % batch_gen == 0
@@ -254,14 +258,7 @@ def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel
     G = copy.deepcopy(opts.G).eval().requires_grad_(False).to(opts.device)
     c_iter = iterate_random_labels(opts=opts, batch_size=batch_gen)
 
-    # Initialize.
-    stats = FeatureStats(**stats_kwargs)
-    assert stats.max_items is not None
-    progress = opts.progress.sub(tag='generator features', num_items=stats.max_items, rel_lo=rel_lo, rel_hi=rel_hi)
-    detector = get_feature_detector(url=detector_url, device=opts.device, num_gpus=opts.num_gpus, rank=opts.rank, verbose=progress.verbose)
-
-    # Main loop.
-    while not stats.is_full():
+    while True:
         images = []
         for _i in range(batch_size // batch_gen):
             z = torch.randn([batch_gen, G.z_dim], device=opts.device)
@@ -271,9 +268,48 @@ def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel
         images = torch.cat(images)
         if images.shape[1] == 1:
             images = images.repeat([1, 3, 1, 1])
-        features = detector(images, **detector_kwargs)
-        stats.append_torch(features, num_gpus=opts.num_gpus, rank=opts.rank)
-        progress.update(stats.num_items)
-    return stats
+        yield images
+
+#----------------------------------------------------------------------------
+
+def get_gen_features_key(detector_url, detector_kwargs, max_items, dataset_kwargs):
+    # The dataset determines the labels fed to a conditional generator.
+    return (detector_url, repr(sorted(detector_kwargs.items())), max_items, repr(sorted(dataset_kwargs.items())))
+
+#----------------------------------------------------------------------------
+
+def compute_feature_stats_for_generator(opts, detector_url, detector_kwargs, rel_lo=0, rel_hi=1, batch_size=64, batch_gen=None, **stats_kwargs):
+    # Reuse the features computed by a shared generator pass, if they were planned for this request.
+    stats = opts.gen_features.get(get_gen_features_key(detector_url, detector_kwargs, stats_kwargs.get('max_items'), opts.dataset_kwargs))
+    if stats is not None and all(getattr(stats, key) for key in ['capture_all', 'capture_mean_cov'] if stats_kwargs.get(key, False)):
+        return stats
+    request = dnnlib.EasyDict(detector_url=detector_url, detector_kwargs=detector_kwargs, stats_kwargs=stats_kwargs)
+    return compute_feature_stats_for_generator_multi(opts, [request], rel_lo=rel_lo, rel_hi=rel_hi, batch_size=batch_size, batch_gen=batch_gen)[0]
+
+#----------------------------------------------------------------------------
+# Feeds the same generated images to several detectors, or to the same
+# detector with different arguments. Each request is a dict with
+# detector_url, detector_kwargs, and stats_kwargs; all requests must have
+# the same max_items. Returns one FeatureStats per request.
+
+def compute_feature_stats_for_generator_multi(opts, requests, rel_lo=0, rel_hi=1, batch_size=64, batch_gen=None):
+    assert len(requests) > 0
+
+    # Initialize.
+    stats_list = [FeatureStats(**request.stats_kwargs) for request in requests]
+    max_items = stats_list[0].max_items
+    assert max_items is not None and all(stats.max_items == max_items for stats in stats_list)
+    progress = opts.progress.sub(tag='generator features', num_items=max_items, rel_lo=rel_lo, rel_hi=rel_hi)
+    detectors = [get_feature_detector(url=request.detector_url, device=opts.device, num_gpus=opts.num_gpus, rank=opts.rank, verbose=progress.verbose) for request in requests]
+
+    # Main loop.
+    image_iter = iterate_generated_images(opts=opts, batch_size=batch_size, batch_gen=batch_gen)
+    while not stats_list[0].is_full():
+        images = next(image_iter)
+        for request, detector, stats in zip(requests, detectors, stats_list):
+            features = detector(images, **request.detector_kwargs)
+            stats.append_torch(features, num_gpus=opts.num_gpus, rank=opts.rank)
+        progress.update(stats_list[0].num_items)
+    return stats_list
 
 #----------------------------------------------------------------------------
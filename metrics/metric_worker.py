@@ -0,0 +1,123 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Background process for evaluating quality metrics on network snapshots
+while training continues."""
+
+import atexit
+import queue
+import traceback
+import torch
+import dnnlib
+
+from . import metric_main
+
+#----------------------------------------------------------------------------
+# Main function of the worker process. Evaluates the latest snapshot handed
+# over by the training loop, skipping any older snapshots that were queued
+# while the previous evaluation was running.
+
+def _worker_fn(metrics, dataset_kwargs, run_dir, device, snapshot_queue, result_queue):
+    import legacy # pylint: disable=import-outside-toplevel
+    device = torch.device(device)
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
+    torch.backends.cuda.matmul.allow_tf32 = False
+    torch.backends.cudnn.allow_tf32 = False
+
+    done = False
+    while not done:
+        snapshot_pkl = snapshot_queue.get()
+        if snapshot_pkl is None:
+            break
+        while True:
+            try:
+                newer_pkl = snapshot_queue.get_nowait()
+            except queue.Empty:
+                break
+            if newer_pkl is None:
+                done = True
+                break
+            print(f'Metric worker: skipping stale snapshot {snapshot_pkl}')
+            snapshot_pkl = newer_pkl
+
+        try:
+            with dnnlib.util.open_url(snapshot_pkl, verbose=False) as f:
+                G = legacy.load_network_pkl(f)['G_ema'].to(device)
+            results = dict()
+            for result_dict in metric_main.calc_metrics(metrics=metrics, G=G, dataset_kwargs=dataset_kwargs, num_gpus=1, rank=0, device=device):
+                metric_main.report_metric(result_dict, run_dir=run_dir, snapshot_pkl=snapshot_pkl)
+                results.update(result_dict.results)
+            result_queue.put((snapshot_pkl, results))
+            del G
+        except Exception: # pylint: disable=broad-except
+            traceback.print_exc()
+            result_queue.put((snapshot_pkl, None))
+
+#----------------------------------------------------------------------------
+# Handle to the worker process, owned by the training loop on rank 0.
+
+class MetricWorker:
+    def __init__(self,
+        metrics,                # List of metric names to evaluate.
+        dataset_kwargs,         # Options for the dataset, see metric_main.calc_metric().
+        run_dir,                # Directory for metric-*.jsonl.
+        device,                 # Device to evaluate on, e.g. 'cuda:1' or 'cpu'.
+    ):
+        ctx = torch.multiprocessing.get_context('spawn')
+        self._snapshot_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._process = ctx.Process(target=_worker_fn, # Not daemonic, as metrics may spawn DataLoader workers.
+            args=(list(metrics), dict(dataset_kwargs), run_dir, str(device), self._snapshot_queue, self._result_queue))
+        self._process.start()
+        atexit.register(self._terminate) # Runs before multiprocessing joins its children on exit.
+
+    def submit(self, snapshot_pkl):
+        r"""Queues a network snapshot pickle for evaluation. Returns immediately."""
+        self._check_alive()
+        self._snapshot_queue.put(snapshot_pkl)
+
+    def poll(self):
+        r"""Returns the results that have become available since the last
+        call as a list of `(snapshot_pkl, results)`, where `results` is None
+        if the evaluation failed. Returns immediately."""
+        finished = []
+        while True:
+            try:
+                finished.append(self._result_queue.get_nowait())
+            except queue.Empty:
+                break
+        self._check_alive()
+        return finished
+
+    def close(self):
+        r"""Waits for the latest submitted snapshot to be evaluated and
+        stops the worker. Returns the remaining results like `poll()`."""
+        if not self._process.is_alive():
+            return []
+        self._snapshot_queue.put(None)
+        finished = []
+        while self._process.is_alive():
+            try:
+                finished.append(self._result_queue.get(timeout=1))
+            except queue.Empty:
+                pass
+        finished += self.poll()
+        self._process.join()
+        return finished
+
+    def _terminate(self):
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+
+    def _check_alive(self):
+        if not self._process.is_alive() and self._process.exitcode not in (None, 0):
+            raise RuntimeError(f'Metric worker exited with code {self._process.exitcode}')
+
+#----------------------------------------------------------------------------
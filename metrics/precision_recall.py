@@ -16,20 +16,57 @@ from . import metric_utils
 
 #----------------------------------------------------------------------------
 
-def compute_distances(row_features, col_features, num_gpus, rank, col_batch_size):
+def compute_distances(row_features, col_features):
+    if row_features.device.type == 'cpu' and row_features.dtype == torch.float16: # cdist does not support float16 on CPU
+        return torch.cdist(row_features.to(torch.float32).unsqueeze(0), col_features.to(torch.float32).unsqueeze(0))[0].to(torch.float16)
+    return torch.cdist(row_features.unsqueeze(0), col_features.unsqueeze(0))[0]
+
+#----------------------------------------------------------------------------
+# Yields (col_begin, col_batch) for the column batches processed by the given
+# rank. The columns are zero-padded to a whole number of batches per rank;
+# the padding must be masked out by the caller.
+
+def iterate_col_batches(col_features, num_gpus, rank, col_batch_size):
     assert 0 <= rank < num_gpus
     num_cols = col_features.shape[0]
     num_batches = ((num_cols - 1) // col_batch_size // num_gpus + 1) * num_gpus
     col_batches = torch.nn.functional.pad(col_features, [0, 0, 0, -num_cols % num_batches]).chunk(num_batches)
-    dist_batches = []
-    for col_batch in col_batches[rank :: num_gpus]:
-        dist_batch = torch.cdist(row_features.unsqueeze(0), col_batch.unsqueeze(0))[0]
-        for src in range(num_gpus):
-            dist_broadcast = dist_batch.clone()
-            if num_gpus > 1:
-                torch.distributed.broadcast(dist_broadcast, src=src)
-            dist_batches.append(dist_broadcast.cpu() if rank == 0 else None)
-    return torch.cat(dist_batches, dim=1)[:, :num_cols] if rank == 0 else None
+    for batch_idx in range(rank, num_batches, num_gpus):
+        yield batch_idx * col_batches[0].shape[0], col_batches[batch_idx]
+
+#----------------------------------------------------------------------------
+# Distance from each row to its k-th nearest column, streaming over column
+# batches while keeping a running top-k per row on the device. Only the
+# per-row top-k are exchanged between ranks.
+
+def compute_kth_distances(row_features, col_features, k, num_gpus, rank, col_batch_size):
+    num_cols = col_features.shape[0]
+    top = torch.full([row_features.shape[0], k], float('inf'), dtype=torch.float32, device=row_features.device)
+    for col_begin, col_batch in iterate_col_batches(col_features, num_gpus=num_gpus, rank=rank, col_batch_size=col_batch_size):
+        dist = compute_distances(row_features, col_batch).to(torch.float32)
+        dist[:, max(num_cols - col_begin, 0):] = float('inf') # padding
+        top = torch.cat([top, dist], dim=1).topk(k, dim=1, largest=False).values
+    if num_gpus > 1:
+        tops = [torch.empty_like(top) for _rank in range(num_gpus)]
+        torch.distributed.all_gather(tops, top)
+        top = torch.cat(tops, dim=1).topk(k, dim=1, largest=False).values
+    return top.max(dim=1).values
+
+#----------------------------------------------------------------------------
+# Whether each row lies within the given radius of at least one column.
+
+def compute_within_radius(row_features, col_features, col_radii, num_gpus, rank, col_batch_size):
+    num_cols = col_features.shape[0]
+    pred = torch.zeros([row_features.shape[0]], dtype=torch.bool, device=row_features.device)
+    for col_begin, col_batch in iterate_col_batches(col_features, num_gpus=num_gpus, rank=rank, col_batch_size=col_batch_size):
+        radii = col_radii[col_begin : col_begin + col_batch.shape[0]] # excludes padding
+        dist = compute_distances(row_features, col_batch)[:, :radii.shape[0]]
+        pred |= (dist <= radii).any(dim=1)
+    if num_gpus > 1:
+        pred = pred.to(torch.float32)
+        torch.distributed.all_reduce(pred, op=torch.distributed.ReduceOp.MAX)
+        pred = (pred != 0)
+    return pred
 
 #----------------------------------------------------------------------------
 
@@ -49,13 +86,11 @@ def compute_pr(opts, max_real, num_gen, nhood_size, row_batch_size, col_batch_si
     for name, manifold, probes in [('precision', real_features, gen_features), ('recall', gen_features, real_features)]:
         kth = []
         for manifold_batch in manifold.split(row_batch_size):
-            dist = compute_distances(row_features=manifold_batch, col_features=manifold, num_gpus=opts.num_gpus, rank=opts.rank, col_batch_size=col_batch_size)
-            kth.append(dist.to(torch.float32).kthvalue(nhood_size + 1).values.to(torch.float16) if opts.rank == 0 else None)
-        kth = torch.cat(kth) if opts.rank == 0 else None
+            kth.append(compute_kth_distances(row_features=manifold_batch, col_features=manifold, k=nhood_size + 1, num_gpus=opts.num_gpus, rank=opts.rank, col_batch_size=col_batch_size).to(torch.float16))
+        kth = torch.cat(kth)
         pred = []
         for probes_batch in probes.split(row_batch_size):
-            dist = compute_distances(row_features=probes_batch, col_features=manifold, num_gpus=opts.num_gpus, rank=opts.rank, col_batch_size=col_batch_size)
-            pred.append((dist <= kth).any(dim=1) if opts.rank == 0 else None)
+            pred.append(compute_within_radius(row_features=probes_batch, col_features=manifold, col_radii=kth, num_gpus=opts.num_gpus, rank=opts.rank, col_batch_size=col_batch_size))
         results[name] = float(torch.cat(pred).to(torch.float32).mean() if opts.rank == 0 else 'nan')
     return results['precision'], results['recall']
 
@@ -0,0 +1,265 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Helpers for synchronizing gradients and optimizer updates across
+multiple processes without allocating temporary buffers in the training
+loop."""
+
+import contextlib
+import torch
+import dnnlib
+
+from . import misc
+
+#----------------------------------------------------------------------------
+# Context manager for temporarily enabling requires_grad, which is needed
+# for registering autograd hooks on a parameter.
+
+@contextlib.contextmanager
+def requires_grad(param):
+    old = param.requires_grad
+    param.requires_grad_(True)
+    try:
+        yield
+    finally:
+        param.requires_grad_(old)
+
+#----------------------------------------------------------------------------
+# Register a hook that is called after the gradient of the given parameter
+# has been accumulated into `param.grad`.
+
+def register_post_accumulate_grad_hook(param, fn):
+    assert isinstance(param, torch.Tensor) and param.is_leaf
+    with requires_grad(param):
+        if hasattr(param, 'register_post_accumulate_grad_hook'): # 2.1.0
+            return param.register_post_accumulate_grad_hook(lambda _param: fn())
+
+        # Fall back to hooking the AccumulateGrad node directly. The node is
+        # only kept alive by the returned handle, so the caller must hold on to it.
+        acc = param.expand_as(param).grad_fn.next_functions[0][0]
+        return (acc, acc.register_hook(lambda *_args: fn()))
+
+#----------------------------------------------------------------------------
+# Persistent flat gradient storage for a set of parameters. The `.grad`
+# attribute of each parameter is a view into one of a small number of
+# preallocated buckets, so that autograd accumulates directly into them
+# and the all-reduce and NaN sanitization can be performed in place.
+#
+# Optionally, the all-reduce can be overlapped with the backward pass of
+# the last accumulation round by calling `arm()` before it. Each bucket is
+# then reduced asynchronously as soon as all of its parameters have seen
+# the same number of gradient accumulations as in the first armed round
+# with the same key, which is used to learn the expected counts.
+
+class GradBuckets:
+    def __init__(self,
+        params,                 # Parameters to manage.
+        bucket_cap_mb   = 25,   # Maximum size of one bucket in megabytes.
+    ):
+        self.params = [param for param in params]
+        assert all(isinstance(param, torch.nn.Parameter) for param in self.params)
+        assert len({id(param) for param in self.params}) == len(self.params)
+
+        # Assign parameters to buckets in reverse order, so that the buckets
+        # become ready roughly in the order that backward produces them.
+        self.buckets = []       # [bucket_idx] => torch.Tensor
+        self.bucket_params = [] # [bucket_idx] => [param_idx, ...]
+        self.views = [None] * len(self.params)
+        self.param_bucket = [None] * len(self.params)
+        groups = []
+        for idx in reversed(range(len(self.params))):
+            param = self.params[idx]
+            assert param.is_contiguous() or param.is_contiguous(memory_format=torch.channels_last)
+            key = (param.dtype, param.device)
+            cap = max(int(bucket_cap_mb * 2**20 // param.element_size()), 1)
+            if len(groups) == 0 or groups[-1][0] != key or groups[-1][2] + param.numel() > cap:
+                groups.append([key, [], 0])
+            groups[-1][1].append(idx)
+            groups[-1][2] += param.numel()
+        for (dtype, device), indices, numel in groups:
+            bucket = torch.zeros([numel], dtype=dtype, device=device)
+            offset = 0
+            for idx in indices:
+                param = self.params[idx]
+                self.views[idx] = bucket.as_strided(param.shape, param.stride(), bucket.storage_offset() + offset)
+                self.param_bucket[idx] = len(self.buckets)
+                offset += param.numel()
+            self.buckets.append(bucket)
+            self.bucket_params.append(indices)
+
+        # Track which parameters received a gradient, so that the optimizer
+        # can skip the rest exactly like it would with `set_to_none=True`.
+        self.touched = [False] * len(self.params)
+        self._hooks = []
+        for idx, param in enumerate(self.params):
+            with requires_grad(param):
+                self._hooks.append(param.register_hook(lambda grad, idx=idx: self._on_grad(idx, grad)))
+            self._hooks.append(register_post_accumulate_grad_hook(param, lambda idx=idx: self._on_grad_accumulated(idx)))
+
+        # State of the overlapped all-reduce.
+        self._learned = dict()  # key => [param_idx] => number of accumulations in the last round
+        self._armed = None      # Key of the current round, None = not armed.
+        self._num_gpus = 1
+        self._counts = None     # [param_idx] => number of accumulations seen so far
+        self._expected = None   # [param_idx] => number of accumulations to wait for, None = learning
+        self._pending = None    # [bucket_idx] => number of parameters that are not ready yet
+        self._handles = []      # [bucket_idx] => async work handle, for launched buckets
+
+    def _on_grad(self, idx, grad):
+        if grad is not None:
+            self.touched[idx] = True
+
+    def _on_grad_accumulated(self, idx):
+        if self._armed is None:
+            return
+        self._counts[idx] += 1
+        if self._expected is None:
+            return
+        bucket_idx = self.param_bucket[idx]
+        if bucket_idx < len(self._handles) or self._counts[idx] > self._expected[idx]:
+            raise RuntimeError(f'Gradient of parameter {idx} was accumulated after its bucket was all-reduced')
+        if self._counts[idx] == self._expected[idx]:
+            self._pending[bucket_idx] -= 1
+            self._launch_ready()
+
+    def _launch_ready(self):
+        # Launch in bucket order, so that all processes issue the collectives consistently.
+        while len(self._handles) < len(self.buckets) and self._pending[len(self._handles)] == 0:
+            self._launch(len(self._handles))
+
+    def _launch(self, bucket_idx):
+        assert bucket_idx == len(self._handles)
+        handle = None
+        if self._num_gpus > 1:
+            handle = torch.distributed.all_reduce(self.buckets[bucket_idx], async_op=True)
+        self._handles.append(handle)
+
+    def arm(self, key, num_gpus=1):
+        r"""Enables overlapped all-reduce for the next accumulation round,
+        which must be the last one before `all_reduce_()`. The key identifies
+        the kind of round (e.g. the training phase) for learning purposes."""
+        assert self._armed is None
+        self._armed = key
+        self._num_gpus = num_gpus
+        self._counts = [0] * len(self.params)
+        self._expected = self._learned.get(key, None)
+        self._handles = []
+        if self._expected is not None:
+            self._pending = [sum(self._expected[idx] > 0 for idx in indices) for indices in self.bucket_params]
+            self._launch_ready()
+
+    def zero_(self):
+        r"""Clears the gradients and points `.grad` of every parameter
+        back to its view in the persistent buckets."""
+        for bucket in self.buckets:
+            bucket.zero_()
+        for idx, (param, view) in enumerate(zip(self.params, self.views)):
+            param.grad = view
+            self.touched[idx] = False
+
+    def all_reduce_(self, num_gpus=1, nan=0, posinf=1e5, neginf=-1e5):
+        r"""Averages the gradients across processes and replaces NaN/Inf
+        in place. Parameters that did not receive a gradient are detached
+        from their views so that the optimizer leaves them untouched."""
+        if self._armed is not None:
+            assert num_gpus == self._num_gpus
+            if self._expected is None:
+                self._learned[self._armed] = self._counts
+            while len(self._handles) < len(self.buckets):
+                self._launch(len(self._handles))
+            self._armed = None
+        for bucket_idx, bucket in enumerate(self.buckets):
+            if num_gpus > 1:
+                if bucket_idx < len(self._handles) and self._handles[bucket_idx] is not None:
+                    self._handles[bucket_idx].wait()
+                else:
+                    torch.distributed.all_reduce(bucket)
+                bucket /= num_gpus
+            misc.nan_to_num(bucket, nan=nan, posinf=posinf, neginf=neginf, out=bucket)
+        self._handles = []
+        for param, touched in zip(self.params, self.touched):
+            if not touched:
+                param.grad = None
+
+#----------------------------------------------------------------------------
+# Optimizer wrapper that shards the optimizer state and the update step
+# across processes, similar to ZeRO stage 1. Each parameter is owned by
+# exactly one rank, which keeps its optimizer state and updates it using the
+# already all-reduced gradient. The owners then broadcast the new values,
+# so that all ranks end up with identical parameters as if every rank had
+# performed the full update.
+
+class ShardedOptimizer:
+    def __init__(self,
+        params,                 # Parameters to optimize.
+        num_gpus    = 1,        # Number of processes sharing the work.
+        rank        = 0,        # Rank of the current process in [0, num_gpus[.
+        **opt_kwargs,           # Options for the underlying optimizer, including class_name.
+    ):
+        assert 0 <= rank < num_gpus
+        self.params = [param for param in params]
+        assert len({(param.dtype, param.device) for param in self.params}) <= 1
+        self.num_gpus = num_gpus
+        self.rank = rank
+
+        # Assign parameters to the least loaded rank, largest first.
+        loads = [0] * num_gpus
+        self.shards = [[] for _ in range(num_gpus)] # [rank] => [param_idx, ...]
+        for idx in sorted(range(len(self.params)), key=lambda idx: -self.params[idx].numel()):
+            owner = min(range(num_gpus), key=lambda r: loads[r])
+            self.shards[owner].append(idx)
+            loads[owner] += self.params[idx].numel()
+        for shard in self.shards:
+            shard.sort()
+
+        # Construct the underlying optimizer for the parameters owned by this rank.
+        self.opt = None
+        local_params = [self.params[idx] for idx in self.shards[rank]]
+        if len(local_params) > 0:
+            self.opt = dnnlib.util.construct_class_by_name(params=local_params, **opt_kwargs) # subclass of torch.optim.Optimizer
+
+        # Persistent flat buffer for broadcasting the updated parameters.
+        # It is sized to the largest shard and reused for each owner in turn,
+        # so that the ranks do not need to hold a second copy of the model.
+        self.flats = [None] * num_gpus # [rank] => torch.Tensor, all aliasing the same buffer
+        self.views = [None] * num_gpus # [rank] => [torch.Tensor, ...]
+        if num_gpus > 1 and len(self.params) > 0:
+            ref = self.params[0]
+            buffer = torch.empty([max(loads)], dtype=ref.dtype, device=ref.device)
+            for owner, shard in enumerate(self.shards):
+                if len(shard) == 0:
+                    continue
+                flat = buffer[:loads[owner]]
+                self.views[owner] = [view.view_as(self.params[idx]) for idx, view in zip(shard, flat.split([self.params[idx].numel() for idx in shard]))]
+                self.flats[owner] = flat
+
+    def zero_grad(self, set_to_none=True):
+        for param in self.params:
+            if set_to_none:
+                param.grad = None
+            elif param.grad is not None:
+                param.grad.zero_()
+
+    @torch.no_grad()
+    def step(self):
+        if self.opt is not None:
+            self.opt.step()
+        if self.num_gpus > 1:
+            for owner, shard in enumerate(self.shards):
+                if len(shard) == 0:
+                    continue
+                params = [self.params[idx] for idx in shard]
+                if owner == self.rank:
+                    for view, param in zip(self.views[owner], params):
+                        view.copy_(param)
+                torch.distributed.broadcast(self.flats[owner], src=owner)
+                if owner != self.rank:
+                    for view, param in zip(self.views[owner], params):
+                        param.copy_(view)
+
+#----------------------------------------------------------------------------
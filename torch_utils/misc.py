@@ -10,6 +10,7 @@ import re
 import contextlib
 import numpy as np
 import torch
+import torch.utils.checkpoint
 import warnings
 import dnnlib
 
@@ -104,6 +105,17 @@ def profiled_function(fn):
     decorator.__name__ = fn.__name__
     return decorator
 
+#----------------------------------------------------------------------------
+# Activation checkpointing that recomputes the given function during the
+# backward pass instead of storing its intermediate activations. Uses the
+# non-reentrant implementation, which supports torch.autograd.grad() and
+# double backward as needed by R1 and path length regularization.
+
+def checkpoint(fn, *args, **kwargs):
+    if not torch.is_grad_enabled():
+        return fn(*args, **kwargs)
+    return torch.utils.checkpoint.checkpoint(fn, *args, use_reentrant=False, **kwargs)
+
 #----------------------------------------------------------------------------
 # Sampler for torch.utils.data.DataLoader that loops over the dataset
 # indefinitely, shuffling items as it goes.
@@ -183,10 +183,12 @@ def _upfirdn2d_ref(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1):
     upH = in_height * upy + pady0 + pady1
     assert upW >= f.shape[-1] and upH >= f.shape[0]
 
-    # Upsample by inserting zeros.
-    x = x.reshape([batch_size, num_channels, in_height, 1, in_width, 1])
-    x = torch.nn.functional.pad(x, [0, upx - 1, 0, 0, 0, upy - 1])
-    x = x.reshape([batch_size, num_channels, in_height * upy, in_width * upx])
+    # Upsample by inserting zeros, preserving the memory format of the input.
+    if upx > 1 or upy > 1:
+        memory_format = torch.channels_last if x.stride(1) == 1 else torch.contiguous_format
+        y = torch.empty([batch_size, num_channels, in_height * upy, in_width * upx], dtype=x.dtype, device=x.device, memory_format=memory_format).zero_()
+        y[:, :, ::upy, ::upx] = x
+        x = y
 
     # Pad or crop.
     x = torch.nn.functional.pad(x, [max(padx0, 0), max(padx1, 0), max(pady0, 0), max(pady1, 0)])
@@ -198,16 +200,14 @@ def _upfirdn2d_ref(x, f, up=1, down=1, padding=0, flip_filter=False, gain=1):
     if not flip_filter:
         f = f.flip(list(range(f.ndim)))
 
-    # Convolve with the filter.
+    # Convolve with the filter and downsample by throwing away pixels, using
+    # a strided convolution so that the output keeps a dense memory layout.
     f = f[np.newaxis, np.newaxis].repeat([num_channels, 1] + [1] * f.ndim)
     if f.ndim == 4:
-        x = conv2d_gradfix.conv2d(input=x, weight=f, groups=num_channels)
+        x = conv2d_gradfix.conv2d(input=x, weight=f, stride=[downy, downx], groups=num_channels)
     else:
-        x = conv2d_gradfix.conv2d(input=x, weight=f.unsqueeze(2), groups=num_channels)
-        x = conv2d_gradfix.conv2d(input=x, weight=f.unsqueeze(3), groups=num_channels)
-
-    # Downsample by throwing away pixels.
-    x = x[:, :, ::downy, ::downx]
+        x = conv2d_gradfix.conv2d(input=x, weight=f.unsqueeze(2), stride=[1, downx], groups=num_channels)
+        x = conv2d_gradfix.conv2d(input=x, weight=f.unsqueeze(3), stride=[downy, 1], groups=num_channels)
     return x
 
 #----------------------------------------------------------------------------
@@ -0,0 +1,101 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Scheduled torch.profiler capture windows for the training loop."""
+
+import os
+import torch
+
+#----------------------------------------------------------------------------
+# Captures a trace of `num_steps` consecutive training steps, starting at the
+# first step at or after `start_kimg`, and optionally again every
+# `every_ticks` ticks. Each window writes a Chrome trace and a table of the
+# most expensive operators into `run_dir`.
+
+class ProfilerWindows:
+    def __init__(self,
+        run_dir,                    # Output directory.
+        start_kimg      = 0,        # Start of the first window.
+        num_steps       = 5,        # Number of training steps per window.
+        every_ticks     = None,     # Start a new window every N ticks after the first one. None = only once.
+        profile_memory  = False,    # Record tensor allocations as well?
+        rank            = 0,        # Rank of the current process, used in file names.
+        device          = torch.device('cpu'),
+        row_limit       = 50,       # Number of operators in the summary table.
+    ):
+        assert num_steps >= 1
+        assert every_ticks is None or every_ticks >= 1
+        self.run_dir = run_dir
+        self.start_nimg = int(start_kimg * 1000)
+        self.num_steps = num_steps
+        self.every_ticks = every_ticks
+        self.profile_memory = profile_memory
+        self.rank = rank
+        self.device = device
+        self.row_limit = row_limit
+        self._prof = None
+        self._prof_nimg = None
+        self._prof_steps = 0
+        self._first_tick = None
+        self._last_tick = None
+
+    def begin_step(self, cur_nimg, cur_tick):
+        r"""Called at the beginning of every training step. Starts a new window if one is due."""
+        if self._prof is not None or cur_nimg < self.start_nimg or cur_tick == self._last_tick:
+            return
+        if self._first_tick is not None and (self.every_ticks is None or (cur_tick - self._first_tick) % self.every_ticks != 0):
+            return
+        if self._first_tick is None:
+            self._first_tick = cur_tick
+        self._last_tick = cur_tick
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._prof = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=self.profile_memory)
+        self._prof.start()
+        self._prof_nimg = cur_nimg
+        self._prof_steps = 0
+
+    def end_step(self):
+        r"""Called at the end of every training step. Finishes the current window after `num_steps` steps."""
+        if self._prof is None:
+            return
+        self._prof_steps += 1
+        self._prof.step()
+        if self._prof_steps >= self.num_steps:
+            self._finish()
+
+    def close(self):
+        r"""Finishes the current window, if any, e.g. when training ends early."""
+        if self._prof is not None:
+            self._finish()
+
+    def _finish(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        self._prof.stop()
+        prefix = os.path.join(self.run_dir, f'profile-{self._prof_nimg//1000:06d}-rank{self.rank}')
+        self._prof.export_chrome_trace(prefix + '.json')
+        events = self._prof.key_averages()
+        with open(prefix + '.txt', 'wt') as f:
+            f.write(f'Captured {self._prof_steps} training steps starting at {self._prof_nimg / 1e3:.1f} kimg.\n\n')
+            f.write(events.table(sort_by=self._sort_key(events, 'time_total'), row_limit=self.row_limit) + '\n')
+            if self.profile_memory:
+                f.write('\n' + events.table(sort_by=self._sort_key(events, 'memory_usage'), row_limit=self.row_limit) + '\n')
+        self._prof = None
+
+    def _sort_key(self, events, suffix):
+        # Device events are only recorded for CUDA. Newer releases rename
+        # 'self_cuda_*' to 'self_device_*' and deprecate the old keys.
+        if self.device.type == 'cuda' and len(events) > 0:
+            for key in [f'self_device_{suffix}', f'self_cuda_{suffix}']:
+                if hasattr(events[0], key):
+                    return key
+        return f'self_cpu_{suffix}'
+
+#----------------------------------------------------------------------------
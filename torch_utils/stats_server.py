@@ -0,0 +1,97 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Minimal HTTP endpoint that exposes the latest training statistics in the
+Prometheus text exposition format."""
+
+import re
+import math
+import threading
+import http.server
+
+#----------------------------------------------------------------------------
+
+class StatsServer:
+    r"""Serves the most recent statistics collected by `training_stats.Collector`
+    at `http://<host>:<port>/metrics` from a background thread.
+
+    `update()` only swaps a reference, so the training loop never waits for
+    the server; the text is rendered by the server thread on each request.
+    Each statistic is exported as a gauge holding its mean, with the name
+    converted to lowercase and non-alphanumeric characters replaced by
+    underscores, e.g. `Timing/sec_per_kimg` => `stylegan_timing_sec_per_kimg`.
+
+    Args:
+        port:       TCP port to listen on. 0 = pick a free port, see `self.port`.
+        host:       Interface to bind to. Use '0.0.0.0' to accept remote scrapers.
+        namespace:  Prefix for all exported metric names.
+    """
+    def __init__(self, port, host='127.0.0.1', namespace='stylegan'):
+        self.namespace = namespace
+        self._snapshot = None # (stats_dict, metrics_dict, timestamp)
+        server = self
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self): # pylint: disable=invalid-name
+                if self.path.split('?')[0] not in ['/', '/metrics']:
+                    self.send_error(404)
+                    return
+                body = server.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                pass # Keep the training log clean.
+        self._httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='stats_server', daemon=True)
+        self._thread.start()
+
+    def update(self, stats_dict, metrics=None, timestamp=None):
+        r"""Publishes new values. `stats_dict` is the result of
+        `Collector.as_dict()` and `metrics` maps metric names to floats."""
+        self._snapshot = (dict(stats_dict), dict(metrics or {}), timestamp)
+
+    def render(self):
+        r"""Returns the latest values in the Prometheus text format."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return ''
+        stats_dict, metrics, timestamp = snapshot
+        lines = []
+        def emit(name, value, help_text=None, labels=''):
+            if value is None or not math.isfinite(value):
+                return
+            if help_text is not None:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name}{labels} {value:.10g}')
+        for name, value in stats_dict.items():
+            if value.num > 0:
+                emit(self._sanitize(name), value.mean, help_text=f'Mean of {name} over the last tick.')
+        metrics = {name: value for name, value in metrics.items() if value is not None and math.isfinite(value)}
+        if len(metrics) > 0:
+            lines.append(f'# HELP {self.namespace}_metric Latest quality metrics.')
+            lines.append(f'# TYPE {self.namespace}_metric gauge')
+        for name, value in metrics.items():
+            emit(f'{self.namespace}_metric', value, labels=f'{{name="{name}"}}')
+        if timestamp is not None:
+            emit(f'{self.namespace}_last_update_timestamp_seconds', timestamp, help_text='Time of the last update.')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def _sanitize(self, name):
+        return self.namespace + '_' + re.sub('[^a-z0-9_]', '_', name.lower())
+
+#----------------------------------------------------------------------------
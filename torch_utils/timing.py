@@ -0,0 +1,86 @@
+# Copyright (c) 2021, NVIDIA CORPORATION & AFFILIATES.  All rights reserved.
+#
+# NVIDIA CORPORATION and its licensors retain all intellectual property
+# and proprietary rights in and to this software, related documentation
+# and any modifications thereto.  Any use, reproduction, disclosure or
+# distribution of this software and related documentation without an express
+# license agreement from NVIDIA CORPORATION is strictly prohibited.
+
+"""Lightweight wall-clock timers for the sections of the training loop,
+with optional export to the Chrome trace event format."""
+
+import json
+import time
+import contextlib
+
+from . import training_stats
+
+#----------------------------------------------------------------------------
+
+class WallTimers:
+    r"""Measures the host wall-clock time spent in named sections of code.
+
+    The time spent in each section is summed until the next call to
+    `report()`, which broadcasts the totals through
+    `training_stats.report()`. Since CUDA kernels are launched
+    asynchronously, the time of GPU-bound sections is attributed to
+    whichever section ends up waiting for the GPU; host-side stalls, such
+    as waiting for the data loader, are measured exactly.
+
+    Args:
+        names:      Names of all sections, in a consistent order across
+                    processes as required by `training_stats.report()`.
+        prefix:     Prefix for the names of the reported statistics.
+        trace_file: Optional path of a Chrome trace JSON file (viewable in
+                    chrome://tracing or Perfetto) that receives one event
+                    per timed section. Written incrementally by `report()`.
+        pid:        Process ID to use in the trace, typically the rank.
+    """
+    def __init__(self, names, prefix='Timing/wall/', trace_file=None, pid=0):
+        self._names = list(names)
+        self._prefix = prefix
+        self._totals = {name: 0.0 for name in self._names}
+        self._pid = pid
+        self._events = []
+        self._trace = None
+        if trace_file is not None:
+            self._trace = open(trace_file, 'wt')
+            self._trace.write('[\n') # The closing bracket is optional in the trace event format.
+            self._trace.write(json.dumps(dict(name='process_name', ph='M', pid=pid, args=dict(name=f'rank {pid}'))) + ',\n')
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        r"""Context manager that adds the time spent inside it to the given section."""
+        assert name in self._totals
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self._totals[name] += end - start
+            if self._trace is not None:
+                self._events.append((name, start, end))
+
+    def report(self):
+        r"""Reports the total seconds spent in each section since the last
+        call, resets the totals, and flushes the trace file."""
+        for name in self._names:
+            training_stats.report(self._prefix + name, self._totals[name])
+            self._totals[name] = 0.0
+        self._flush_trace()
+
+    def close(self):
+        self._flush_trace()
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def _flush_trace(self):
+        if self._trace is None:
+            return
+        for name, start, end in self._events:
+            self._trace.write(json.dumps(dict(name=name, ph='X', ts=round(start * 1e6, 3), dur=round((end - start) * 1e6, 3), pid=self._pid, tid=0)) + ',\n')
+        self._events = []
+        self._trace.flush()
+
+#----------------------------------------------------------------------------
@@ -12,6 +12,7 @@ synchronization overhead as well as the amount of boilerplate in user
 code."""
 
 import re
+import contextlib
 import numpy as np
 import torch
 import dnnlib
@@ -28,6 +29,10 @@ _sync_device    = None          # Device to use for multiprocess communication.
 _sync_called    = False         # Has _sync() been called yet?
 _counters       = dict()        # Running counters on each device, updated by report(): name => device => torch.Tensor
 _cumulative     = dict()        # Cumulative counters on the CPU, updated by _sync(): name => torch.Tensor
+_subscribers    = dict()        # Additional on-device accumulators, updated by report(): name => [torch.Tensor, ...]
+_max_pending    = None          # Number of values to buffer per name and device before reducing them. None = immediate.
+_pending        = dict()        # Values buffered by report() in deferred mode: name => device => [torch.Tensor, ...]
+_name_prefix    = ''            # Prefix prepended to the names passed to report(), set by name_prefix().
 
 #----------------------------------------------------------------------------
 
@@ -52,6 +57,48 @@ def init_multiprocessing(rank, sync_device):
 
 #----------------------------------------------------------------------------
 
+def init_deferred(max_pending=256):
+    r"""Enables or disables deferred accumulation in `report()`.
+
+    In deferred mode, `report()` only records a reference to the given
+    values. All values buffered for a given name and device are reduced
+    into the internal counters in one batched operation when they are
+    needed by `Collector.update()` or `DeviceCollector.update()`, or when
+    `max_pending` values have been buffered. This replaces the handful of
+    small kernels per call with a few kernels per round.
+
+    The tensors passed to `report()` must not be modified in-place after
+    the call, as their contents are only read later.
+
+    Args:
+        max_pending:    Maximum number of values to buffer per name and
+                        device, or None to disable deferred mode.
+    """
+    global _max_pending
+    assert max_pending is None or max_pending >= 1
+    for name in list(_pending):
+        _flush(name)
+    _max_pending = max_pending
+
+#----------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def name_prefix(prefix):
+    r"""Context manager that prepends the given prefix to the names of all
+    statistics broadcasted by `report()` and `report0()` inside it. This
+    allows collecting the same statistics separately for several models
+    trained in the same process, e.g. `name_prefix('run00/')`.
+    """
+    global _name_prefix
+    old = _name_prefix
+    _name_prefix = old + prefix
+    try:
+        yield
+    finally:
+        _name_prefix = old
+
+#----------------------------------------------------------------------------
+
 @misc.profiled_function
 def report(name, value):
     r"""Broadcasts the given set of scalars to all interested instances of
@@ -76,6 +123,7 @@ def report(name, value):
     Returns:
         The same `value` that was passed in.
     """
+    name = _name_prefix + name
     if name not in _counters:
         _counters[name] = dict()
 
@@ -83,7 +131,17 @@ def report(name, value):
     if elems.numel() == 0:
         return value
 
-    elems = elems.detach().flatten().to(_reduce_dtype)
+    if _max_pending is not None:
+        pending = _pending.setdefault(name, dict()).setdefault(elems.device, [])
+        pending.append(elems.detach().flatten())
+        if len(pending) >= _max_pending:
+            _flush(name)
+        return value
+
+    _accumulate(name, elems.detach().flatten().to(_reduce_dtype))
+    return value
+
+def _accumulate(name, elems):
     moments = torch.stack([
         torch.ones_like(elems).sum(),
         elems.sum(),
@@ -96,7 +154,15 @@ def report(name, value):
     if device not in _counters[name]:
         _counters[name][device] = torch.zeros_like(moments)
     _counters[name][device].add_(moments)
-    return value
+    for acc in _subscribers.get(name, []):
+        acc.add_(moments.to(acc.device))
+
+def _flush(name):
+    r"""Reduces the values buffered by `report()` for the given statistic
+    into the internal counters, one batched operation per device.
+    """
+    for elems in _pending.pop(name, dict()).values():
+        _accumulate(name, torch.cat(elems).to(_reduce_dtype))
 
 #----------------------------------------------------------------------------
 
@@ -110,6 +176,20 @@ def report0(name, value):
 
 #----------------------------------------------------------------------------
 
+def discard():
+    r"""Drops all scalars reported by the current process since they were
+    last synchronized, without broadcasting them to any `Collector`.
+    Intended for values produced by warm-up or probing steps that should
+    not count towards the first averages. Must be called by all processes.
+    `DeviceCollector` instances need to be reset separately.
+    """
+    _pending.clear()
+    for counters in _counters.values():
+        for counter in counters.values():
+            counter.zero_()
+
+#----------------------------------------------------------------------------
+
 class Collector:
     r"""Collects the scalars broadcasted by `report()` and `report0()` and
     computes their long-term averages (mean and standard deviation) over
@@ -231,6 +311,58 @@ class Collector:
 
 #----------------------------------------------------------------------------
 
+class DeviceCollector:
+    r"""Collects a single statistic broadcasted by `report()` into an
+    on-device accumulator and reduces it across processes asynchronously.
+
+    Unlike `Collector`, this class never transfers data to the CPU. Each
+    call to `update()` starts reducing the values accumulated since the
+    previous call and returns the result started by the previous call,
+    i.e., the statistics lag one round behind. This allows the caller to
+    consume them without stalling the training stream.
+
+    Args:
+        name:   Name of the statistic to collect.
+        device: PyTorch device to accumulate on. Must be usable with
+                `torch.distributed` in multi-process settings.
+    """
+    def __init__(self, name, device):
+        self._name = name
+        self._acc = torch.zeros([_num_moments], dtype=_counter_dtype, device=device)
+        self._pending = None
+        _subscribers.setdefault(name, []).append(self._acc)
+
+    def update(self):
+        r"""Starts reducing the moments accumulated since the last call and
+        returns the moments started by the previous call as an on-device
+        tensor `[num_scalars, sum_of_scalars, sum_of_squares]`, summed
+        across processes, or None on the first call.
+        """
+        _flush(self._name)
+        snapshot = self._acc.clone()
+        self._acc.zero_()
+        handle = None
+        if _sync_device is not None:
+            handle = torch.distributed.all_reduce(snapshot, async_op=True)
+        prev, self._pending = self._pending, (snapshot, handle)
+        if prev is None:
+            return None
+        if prev[1] is not None:
+            prev[1].wait() # Does not block the host with NCCL.
+        return prev[0]
+
+    def reset(self):
+        r"""Discards all values collected so far, including any pending
+        reduction.
+        """
+        _flush(self._name)
+        if self._pending is not None and self._pending[1] is not None:
+            self._pending[1].wait()
+        self._pending = None
+        self._acc.zero_()
+
+#----------------------------------------------------------------------------
+
 def _sync(names):
     r"""Synchronize the global cumulative counters across devices and
     processes. Called internally by `Collector.update()`.
@@ -244,6 +376,7 @@ def _sync(names):
     deltas = []
     device = _sync_device if _sync_device is not None else torch.device('cpu')
     for name in names:
+        _flush(name)
         delta = torch.zeros([_num_moments], dtype=_counter_dtype, device=device)
         for counter in _counters[name].values():
             delta.add_(counter.to(device))
@@ -266,3 +399,39 @@ def _sync(names):
     return [(name, _cumulative[name]) for name in names]
 
 #----------------------------------------------------------------------------
+# Micro-benchmark of the per-call overhead of report() with and without
+# deferred accumulation, including the final Collector.update().
+# Usage: python -m torch_utils.training_stats [device]
+
+def _benchmark(device='cpu', num_calls=20000, num_names=8, num_elems=32, max_pending=256):
+    import time
+    device = torch.device(device)
+    values = [torch.randn([num_elems], device=device) for _ in range(num_names)]
+    names = [f'Bench/stat{idx}' for idx in range(num_names)]
+    results = dict()
+    for label, mode in [('immediate', None), (f'deferred ({max_pending})', max_pending)]:
+        init_deferred(mode)
+        collector = Collector(regex='Bench/.*')
+        for idx in range(num_calls // 10): # warm-up
+            report(names[idx % num_names], values[idx % num_names])
+        collector.update()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for idx in range(num_calls):
+            report(names[idx % num_names], values[idx % num_names])
+        collector.update()
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        elapsed = time.perf_counter() - start
+        results[label] = {name: collector.mean(name) for name in names}
+        print(f'{label:<16s} {elapsed / num_calls * 1e6:8.2f} us/call')
+    init_deferred(None)
+    ref, res = results.values()
+    print(f'max abs difference of means: {max(abs(ref[name] - res[name]) for name in names):.3g}')
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(*sys.argv[1:2])
+
+#----------------------------------------------------------------------------
@@ -25,42 +25,72 @@ from torch_utils import custom_ops
 
 #----------------------------------------------------------------------------
 
-def subprocess_fn(rank, c, temp_dir):
+def get_env_launch():
+    # Rank and world size set by an external launcher (e.g. torchrun or SLURM wrappers).
+    world_size = int(os.environ['WORLD_SIZE'])
+    rank = int(os.environ['RANK'])
+    local_rank = int(os.environ.get('LOCAL_RANK', rank))
+    return world_size, rank, local_rank
+
+#----------------------------------------------------------------------------
+
+def subprocess_fn(rank, c, temp_dir, backend='nccl', local_rank=None):
+    local_rank = rank if local_rank is None else local_rank
     dnnlib.util.Logger(file_name=os.path.join(c.run_dir, 'log.txt'), file_mode='a', should_flush=True)
 
     # Init torch.distributed.
-    if c.num_gpus > 1:
+    if c.num_gpus > 1 and not torch.distributed.is_initialized():
         init_file = os.path.abspath(os.path.join(temp_dir, '.torch_distributed_init'))
         if os.name == 'nt':
             init_method = 'file:///' + init_file.replace('\\', '/')
             torch.distributed.init_process_group(backend='gloo', init_method=init_method, rank=rank, world_size=c.num_gpus)
         else:
             init_method = f'file://{init_file}'
-            torch.distributed.init_process_group(backend='nccl', init_method=init_method, rank=rank, world_size=c.num_gpus)
+            torch.distributed.init_process_group(backend=backend, init_method=init_method, rank=rank, world_size=c.num_gpus)
 
     # Init torch_utils.
-    sync_device = torch.device('cuda', rank) if c.num_gpus > 1 else None
+    device = torch.device('cuda', local_rank) if torch.cuda.is_available() else torch.device('cpu')
+    sync_device = device if c.num_gpus > 1 else None
     training_stats.init_multiprocessing(rank=rank, sync_device=sync_device)
     if rank != 0:
         custom_ops.verbosity = 'none'
 
     # Execute training loop.
-    training_loop.training_loop(rank=rank, **c)
+    training_loop.training_loop(rank=rank, local_rank=local_rank, **c)
 
 #----------------------------------------------------------------------------
 
-def launch_training(c, desc, outdir, dry_run):
+def launch_training(c, desc, outdir, dry_run, launcher='spawn', backend='nccl'):
     dnnlib.util.Logger(should_flush=True)
 
+    # Join the external launcher's process group right away, so that all nodes agree on the output directory.
+    rank = local_rank = 0
+    if launcher == 'env':
+        _world_size, rank, local_rank = get_env_launch()
+        if torch.cuda.is_available():
+            torch.cuda.set_device(local_rank)
+        torch.distributed.init_process_group(backend=backend, init_method='env://', rank=rank, world_size=c.num_gpus)
+
     # Pick output directory.
-    prev_run_dirs = []
-    if os.path.isdir(outdir):
-        prev_run_dirs = [x for x in os.listdir(outdir) if os.path.isdir(os.path.join(outdir, x))]
-    prev_run_ids = [re.match(r'^\d+', x) for x in prev_run_dirs]
-    prev_run_ids = [int(x.group()) for x in prev_run_ids if x is not None]
-    cur_run_id = max(prev_run_ids, default=-1) + 1
-    c.run_dir = os.path.join(outdir, f'{cur_run_id:05d}-{desc}')
-    assert not os.path.exists(c.run_dir)
+    if rank == 0:
+        prev_run_dirs = []
+        if os.path.isdir(outdir):
+            prev_run_dirs = [x for x in os.listdir(outdir) if os.path.isdir(os.path.join(outdir, x))]
+        prev_run_ids = [re.match(r'^\d+', x) for x in prev_run_dirs]
+        prev_run_ids = [int(x.group()) for x in prev_run_ids if x is not None]
+        cur_run_id = max(prev_run_ids, default=-1) + 1
+        c.run_dir = os.path.join(outdir, f'{cur_run_id:05d}-{desc}')
+        assert not os.path.exists(c.run_dir)
+    if launcher == 'env':
+        run_dir = [c.get('run_dir', None)]
+        torch.distributed.broadcast_object_list(run_dir, src=0)
+        c.run_dir = run_dir[0]
+    if rank != 0:
+        if not dry_run:
+            torch.distributed.barrier() # rank 0 creates the output directory first
+            os.makedirs(c.run_dir, exist_ok=True) # in case the nodes do not share a file system
+            subprocess_fn(rank=rank, c=c, temp_dir=None, backend=backend, local_rank=local_rank)
+        return
 
     # Print options.
     print()
@@ -69,6 +99,7 @@ def launch_training(c, desc, outdir, dry_run):
     print()
     print(f'Output directory:    {c.run_dir}')
     print(f'Number of GPUs:      {c.num_gpus}')
+    print(f'Launcher:            {launcher} ({backend})')
     print(f'Batch size:          {c.batch_size} images')
     print(f'Training duration:   {c.total_kimg} kimg')
     print(f'Dataset path:        {c.training_set_kwargs.path}')
@@ -91,12 +122,16 @@ def launch_training(c, desc, outdir, dry_run):
 
     # Launch processes.
     print('Launching processes...')
+    if launcher == 'env':
+        torch.distributed.barrier() # others follow
+        subprocess_fn(rank=0, c=c, temp_dir=None, backend=backend, local_rank=local_rank)
+        return
     torch.multiprocessing.set_start_method('spawn')
     with tempfile.TemporaryDirectory() as temp_dir:
         if c.num_gpus == 1:
-            subprocess_fn(rank=0, c=c, temp_dir=temp_dir)
+            subprocess_fn(rank=0, c=c, temp_dir=temp_dir, backend=backend)
         else:
-            torch.multiprocessing.spawn(fn=subprocess_fn, args=(c, temp_dir), nprocs=c.num_gpus)
+            torch.multiprocessing.spawn(fn=subprocess_fn, args=(c, temp_dir, backend), nprocs=c.num_gpus)
 
 #----------------------------------------------------------------------------
 
@@ -170,16 +205,24 @@ def locate_latest_pkl(outdir: str):
 @click.option('--augpipe',      help='Augmentation pipeline',                                   type=click.Choice(['b','bg', 'bgc']), default='bgc', show_default=True)
 @click.option('--resume',       help='Resume from given network pickle (PATH, URL or "latest")', metavar='[PATH|URL|"latest"]',  type=str)
 @click.option('--freezed',      help='Freeze first layers of D', metavar='INT',                 type=click.IntRange(min=0), default=0, show_default=True)
+@click.option('--freeze-g',     help='Freeze G parameters whose name matches', metavar='REGEX',  type=str)
+@click.option('--freeze-d',     help='Freeze D parameters whose name matches', metavar='REGEX',  type=str)
+@click.option('--ada-async',    help='Non-blocking ADA adjustment, one interval late', metavar='BOOL', type=bool, default=False, show_default=True)
 @click.option('--initstrength', help='Override ADA strength at start',                          type=click.FloatRange(min=0))
 
 # Misc hyperparameters.
 @click.option('--p',            help='Probability for --aug=fixed', metavar='FLOAT',            type=click.FloatRange(min=0, max=1), default=0.2, show_default=True)
 @click.option('--target',       help='Target value for --aug=ada', metavar='FLOAT',             type=click.FloatRange(min=0, max=1), default=0.6, show_default=True)
 @click.option('--batch-gpu',    help='Limit batch size per GPU', metavar='INT',                 type=click.IntRange(min=1))
+@click.option('--tune-batch',   help='Reduce --batch-gpu to what fits in memory', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--headroom',     help='Memory headroom for --tune-batch', metavar='FLOAT',       type=click.FloatRange(min=0, max=1), default=0.1, show_default=True)
 @click.option('--cbase',        help='Capacity multiplier', metavar='INT',                      type=click.IntRange(min=1), default=32768, show_default=True)
 @click.option('--cmax',         help='Max. feature maps', metavar='INT',                        type=click.IntRange(min=1), default=512, show_default=True)
 @click.option('--glr',          help='G learning rate  [default: varies]', metavar='FLOAT',     type=click.FloatRange(min=0))
 @click.option('--dlr',          help='D learning rate', metavar='FLOAT',                        type=click.FloatRange(min=0), default=0.002, show_default=True)
+@click.option('--pack-gamma',   help='Train packed runs with these R1 weights', metavar='[FLOAT,...]', type=parse_comma_separated_list)
+@click.option('--pack-glr',     help='Train packed runs with these G learning rates', metavar='[FLOAT,...]', type=parse_comma_separated_list)
+@click.option('--pack-dlr',     help='Train packed runs with these D learning rates', metavar='[FLOAT,...]', type=parse_comma_separated_list)
 @click.option('--map-depth',    help='Mapping network depth  [default: varies]', metavar='INT', type=click.IntRange(min=1))
 @click.option('--mbstd-group',  help='Minibatch std group size', metavar='INT',                 type=click.IntRange(min=1), default=4, show_default=True)
 
@@ -195,12 +238,33 @@ def locate_latest_pkl(outdir: str):
 # Misc settings.
 @click.option('--desc',         help='String to include in result dir name', metavar='STR',     type=str)
 @click.option('--metrics',      help='Quality metrics', metavar='[NAME|A,B,C|none]',            type=parse_comma_separated_list, default='fid50k_full', show_default=True)
+@click.option('--metrics-async', help='Evaluate metrics in a background process', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--metrics-device', help='Device for --metrics-async, e.g. cuda:1', metavar='STR', type=str)
 @click.option('--kimg',         help='Total training duration', metavar='KIMG',                 type=click.IntRange(min=1), default=25000, show_default=True)
 @click.option('--tick',         help='How often to print progress', metavar='KIMG',             type=click.IntRange(min=1), default=4, show_default=True)
 @click.option('--snap',         help='How often to save snapshots', metavar='TICKS',            type=click.IntRange(min=1), default=50, show_default=True)
+@click.option('--snap-batch',   help='Images to render at once for image snapshots', metavar='INT', type=click.IntRange(min=1))
 @click.option('--seed',         help='Random seed', metavar='INT',                              type=click.IntRange(min=0), default=0, show_default=True)
 @click.option('--fp32',         help='Disable mixed-precision', metavar='BOOL',                 type=bool, default=False, show_default=True)
 @click.option('--nobench',      help='Disable cuDNN benchmarking', metavar='BOOL',              type=bool, default=False, show_default=True)
+@click.option('--cl',           help='Use channels-last memory format in G and D', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--fast-start',   help='Cache reals grid, overlap init steps', metavar='BOOL',    type=bool, default=False, show_default=True)
+@click.option('--sparse-aug',   help='Only augment samples with non-identity transforms', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--reuse-gen',    help='Reuse Gmain images in Dmain', metavar='BOOL',             type=bool, default=False, show_default=True)
+@click.option('--fuse-d',       help='Single D pass over real and fake images', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--ckpt-res',     help='Recompute activations for N highest res.', metavar='INT', type=click.IntRange(min=0), default=0, show_default=True)
+@click.option('--overlap',      help='Overlap gradient all-reduce with backward', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--shard-opt',    help='Shard optimizer state across GPUs', metavar='BOOL',       type=bool, default=False, show_default=True)
+@click.option('--defer-stats',  help='Batch reported statistics, N values at a time', metavar='INT', type=click.IntRange(min=1))
+@click.option('--wall-trace',   help='Export wall-clock timers as Chrome trace', metavar='BOOL', type=bool, default=False, show_default=True)
+@click.option('--prof-kimg',    help='Capture torch.profiler trace at given kimg', metavar='KIMG', type=click.FloatRange(min=0))
+@click.option('--prof-steps',   help='Training steps per profiler capture', metavar='INT',      type=click.IntRange(min=1), default=5, show_default=True)
+@click.option('--prof-ticks',   help='Repeat profiler capture every N ticks', metavar='TICKS',  type=click.IntRange(min=1))
+@click.option('--prof-mem',     help='Include memory in profiler capture', metavar='BOOL',      type=bool, default=False, show_default=True)
+@click.option('--stats-port',   help='Serve live statistics in Prometheus format on this port', metavar='INT', type=click.IntRange(min=0))
+@click.option('--stats-host',   help='Interface for --stats-port', metavar='ADDR',             type=str, default='127.0.0.1', show_default=True)
+@click.option('--launcher',     help='How the processes are started',                           type=click.Choice(['spawn', 'env']), default='spawn', show_default=True)
+@click.option('--backend',      help='torch.distributed backend',                               type=click.Choice(['nccl', 'gloo']), default='nccl', show_default=True)
 @click.option('--workers',      help='DataLoader worker processes', metavar='INT',              type=click.IntRange(min=1), default=3, show_default=True)
 @click.option('-n','--dry-run', help='Print training options and exit',                         is_flag=True)
 
@@ -225,6 +289,12 @@ def main(**kwargs):
     # Train StyleGAN2 for FFHQ at 1024x1024 resolution using 8 GPUs.
     python train.py --outdir=~/training-runs --cfg=stylegan2 --data=~/datasets/ffhq-1024x1024.zip \\
         --gpus=8 --batch=32 --gamma=10 --mirror=1 --aug=noaug
+
+    \b
+    # Train StyleGAN3-T on 2 nodes with 8 GPUs each, started by torchrun on every node.
+    torchrun --nnodes=2 --nproc_per_node=8 --rdzv_backend=c10d --rdzv_endpoint=$MASTER_ADDR:29500 \\
+        train.py --launcher=env --outdir=~/training-runs --cfg=stylegan3-t --data=~/datasets/afhqv2-512x512.zip \\
+        --gpus=16 --batch=32 --gamma=8.2 --mirror=1
     """
 
     # Initialize config.
@@ -250,18 +320,33 @@ def main(**kwargs):
     c.num_gpus = opts.gpus
     c.batch_size = opts.batch
     c.batch_gpu = opts.batch_gpu or opts.batch // opts.gpus
+    if opts.tune_batch:
+        c.batch_gpu_tune = True
+        c.batch_gpu_headroom = opts.headroom
     c.G_kwargs.channel_base = c.D_kwargs.channel_base = opts.cbase
     c.G_kwargs.channel_max = c.D_kwargs.channel_max = opts.cmax
     c.G_kwargs.mapping_kwargs.num_layers = (8 if opts.cfg == 'stylegan2' else 2) if opts.map_depth is None else opts.map_depth
     c.D_kwargs.block_kwargs.freeze_layers = opts.freezed
+    for name, spec in [('G', opts.freeze_g), ('D', opts.freeze_d)]:
+        if spec is not None:
+            try:
+                re.compile(spec)
+            except re.error as err:
+                raise click.ClickException(f'--freeze-{name.lower()}: {err}')
+            c[f'{name}_freeze'] = spec
     c.D_kwargs.epilogue_kwargs.mbstd_group_size = opts.mbstd_group
     c.loss_kwargs.r1_gamma = opts.gamma
     c.G_opt_kwargs.lr = (0.002 if opts.cfg == 'stylegan2' else 0.0025) if opts.glr is None else opts.glr
     c.D_opt_kwargs.lr = opts.dlr
     c.metrics = opts.metrics
+    if opts.metrics_async:
+        c.metrics_async = True
+        c.metrics_device = opts.metrics_device
     c.total_kimg = opts.kimg
     c.kimg_per_tick = opts.tick
     c.image_snapshot_ticks = c.network_snapshot_ticks = opts.snap
+    if opts.snap_batch is not None:
+        c.image_snapshot_batch = opts.snap_batch
     c.random_seed = c.training_set_kwargs.random_seed = opts.seed
     c.data_loader_kwargs.num_workers = opts.workers
 
@@ -272,6 +357,11 @@ def main(**kwargs):
         raise click.ClickException('--batch must be a multiple of --gpus times --batch-gpu')
     if c.batch_gpu < c.D_kwargs.epilogue_kwargs.mbstd_group_size:
         raise click.ClickException('--batch-gpu cannot be smaller than --mbstd')
+    if opts.launcher == 'env':
+        if 'WORLD_SIZE' not in os.environ or 'RANK' not in os.environ:
+            raise click.ClickException('--launcher=env requires WORLD_SIZE and RANK to be set by the launcher')
+        if get_env_launch()[0] != c.num_gpus:
+            raise click.ClickException('--gpus must match WORLD_SIZE when using --launcher=env')
     if any(not metric_main.is_valid_metric(metric) for metric in c.metrics):
         raise click.ClickException('\n'.join(['--metrics can only contain the following values:'] + metric_main.list_valid_metrics()))
 
@@ -305,8 +395,12 @@ def main(**kwargs):
             c.augment_kwargs = dnnlib.EasyDict(class_name='training.augment.AugmentPipe', xflip=0, rotate90=0, xint=1, scale=1, rotate=1, aniso=1, xfrac=1, brightness=0, contrast=0, lumaflip=0, hue=0, saturation=0)
         else:
             c.augment_kwargs = dnnlib.EasyDict(class_name='training.augment.AugmentPipe', xflip=1, rotate90=1, xint=1, scale=1, rotate=1, aniso=1, xfrac=1, brightness=1, contrast=1, lumaflip=1, hue=1, saturation=1)
+        if opts.sparse_aug:
+            c.augment_kwargs.sparse = True
         if opts.aug == 'ada':
             c.ada_target = opts.target
+            if opts.ada_async:
+                c.ada_async = True
         if opts.aug == 'fixed':
             c.augment_p = opts.p
 
@@ -331,14 +425,66 @@ def main(**kwargs):
         c.G_kwargs.conv_clamp = c.D_kwargs.conv_clamp = None
     if opts.nobench:
         c.cudnn_benchmark = False
+    if opts.cl:
+        c.G_kwargs.channels_last = True
+        c.D_kwargs.block_kwargs.channels_last = True
+    if opts.fast_start:
+        c.fast_start = True
+    if opts.reuse_gen:
+        c.loss_kwargs.reuse_gen = True
+    if opts.fuse_d:
+        c.loss_kwargs.fuse_D = True
+    if opts.ckpt_res > 0:
+        c.G_kwargs.num_checkpoint_res = c.D_kwargs.num_checkpoint_res = opts.ckpt_res
+    if opts.overlap:
+        c.grad_overlap = True
+    if opts.shard_opt:
+        c.shard_opt = True
+    if opts.defer_stats is not None:
+        c.stats_max_pending = opts.defer_stats
+    if opts.wall_trace:
+        c.wall_trace = True
+    if opts.prof_kimg is not None:
+        c.profile_kimg = opts.prof_kimg
+        c.profile_steps = opts.prof_steps
+        c.profile_ticks = opts.prof_ticks
+        c.profile_memory = opts.prof_mem
+    if opts.stats_port is not None:
+        c.stats_port = opts.stats_port
+        c.stats_host = opts.stats_host
+
+    # Packed runs sharing the data pipeline, e.g. for hyperparameter sweeps.
+    try:
+        pack = {key: [float(value) for value in values] for key, values in [('gamma', opts.pack_gamma), ('glr', opts.pack_glr), ('dlr', opts.pack_dlr)] if values}
+    except ValueError as err:
+        raise click.ClickException(f'--pack-*: {err}')
+    if len(pack) > 0:
+        num_runs = max(len(values) for values in pack.values())
+        if any(len(values) not in [1, num_runs] for values in pack.values()):
+            raise click.ClickException('--pack-gamma, --pack-glr, and --pack-dlr must list the same number of values, or a single value')
+        if opts.tune_batch or opts.metrics_async:
+            raise click.ClickException('--pack-* cannot be combined with --tune-batch or --metrics-async')
+        c.packed_runs = []
+        for idx in range(num_runs):
+            values = {key: pack[key][min(idx, len(pack[key]) - 1)] for key in pack}
+            run = dnnlib.EasyDict(desc='-'.join(f'{key}{value:g}' for key, value in values.items()), loss_kwargs=dnnlib.EasyDict(), G_opt_kwargs=dnnlib.EasyDict(), D_opt_kwargs=dnnlib.EasyDict())
+            if 'gamma' in values:
+                run.loss_kwargs.r1_gamma = values['gamma']
+            if 'glr' in values:
+                run.G_opt_kwargs.lr = values['glr']
+            if 'dlr' in values:
+                run.D_opt_kwargs.lr = values['dlr']
+            c.packed_runs.append(run)
 
     # Description string.
     desc = f'{opts.cfg:s}-{dataset_name:s}-gpus{c.num_gpus:d}-batch{c.batch_size:d}-gamma{c.loss_kwargs.r1_gamma:g}'
+    if c.get('packed_runs') is not None:
+        desc += f'-pack{len(c.packed_runs):d}'
     if opts.desc is not None:
         desc += f'-{opts.desc}'
 
     # Launch.
-    launch_training(c=c, desc=desc, outdir=opts.outdir, dry_run=opts.dry_run)
+    launch_training(c=c, desc=desc, outdir=opts.outdir, dry_run=opts.dry_run, launcher=opts.launcher, backend=opts.backend)
 
 #----------------------------------------------------------------------------
 
@@ -111,6 +111,22 @@ def scale2d_inv(sx, sy, **kwargs):
 def rotate2d_inv(theta, **kwargs):
     return rotate2d(-theta, **kwargs)
 
+#----------------------------------------------------------------------------
+# Helpers for executing a per-sample transformation only on the samples
+# whose parameters differ from the identity.
+
+def nonidentity_indices(params, identity, atol=1e-6):
+    delta = (params - identity).abs().reshape(params.shape[0], -1).max(dim=1).values
+    return torch.nonzero(delta > atol).squeeze(1) # Synchronizes with the host.
+
+def apply_to_subset(fn, images, idx, *params):
+    if idx is None or idx.numel() == images.shape[0]:
+        return fn(images, *params)
+    if idx.numel() == 0:
+        return images
+    subset = fn(images.index_select(0, idx), *[x.index_select(0, idx) for x in params])
+    return images.index_copy(0, idx, subset.to(images.dtype))
+
 #----------------------------------------------------------------------------
 # Versatile image augmentation pipeline from the paper
 # "Training Generative Adversarial Networks with Limited Data".
@@ -126,6 +142,7 @@ class AugmentPipe(torch.nn.Module):
         brightness=0, contrast=0, lumaflip=0, hue=0, saturation=0, brightness_std=0.2, contrast_std=0.5, hue_max=1, saturation_std=1,
         imgfilter=0, imgfilter_bands=[1,1,1,1], imgfilter_std=1,
         noise=0, cutout=0, noise_std=0.1, cutout_size=0.5,
+        sparse=False,
     ):
         super().__init__()
         self.register_buffer('p', torch.ones([]))       # Overall multiplier for augmentation probability.
@@ -168,6 +185,9 @@ class AugmentPipe(torch.nn.Module):
         self.noise_std        = float(noise_std)        # Standard deviation of additive RGB noise.
         self.cutout_size      = float(cutout_size)      # Size of the cutout rectangle, relative to image dimensions.
 
+        # Execution.
+        self.sparse           = bool(sparse)            # Run geometric, color, and filtering stages only on the samples they change?
+
         # Setup orthogonal lowpass filter for geometric augmentations.
         self.register_buffer('Hz_geom', upfirdn2d.setup_filter(wavelets['sym6']))
 
@@ -273,37 +293,8 @@ class AugmentPipe(torch.nn.Module):
 
         # Execute if the transform is not identity.
         if G_inv is not I_3:
-
-            # Calculate padding.
-            cx = (width - 1) / 2
-            cy = (height - 1) / 2
-            cp = matrix([-cx, -cy, 1], [cx, -cy, 1], [cx, cy, 1], [-cx, cy, 1], device=device) # [idx, xyz]
-            cp = G_inv @ cp.t() # [batch, xyz, idx]
-            Hz_pad = self.Hz_geom.shape[0] // 4
-            margin = cp[:, :2, :].permute(1, 0, 2).flatten(1) # [xy, batch * idx]
-            margin = torch.cat([-margin, margin]).max(dim=1).values # [x0, y0, x1, y1]
-            margin = margin + misc.constant([Hz_pad * 2 - cx, Hz_pad * 2 - cy] * 2, device=device)
-            margin = margin.max(misc.constant([0, 0] * 2, device=device))
-            margin = margin.min(misc.constant([width-1, height-1] * 2, device=device))
-            mx0, my0, mx1, my1 = margin.ceil().to(torch.int32)
-
-            # Pad image and adjust origin.
-            images = torch.nn.functional.pad(input=images, pad=[mx0,mx1,my0,my1], mode='reflect')
-            G_inv = translate2d((mx0 - mx1) / 2, (my0 - my1) / 2) @ G_inv
-
-            # Upsample.
-            images = upfirdn2d.upsample2d(x=images, f=self.Hz_geom, up=2)
-            G_inv = scale2d(2, 2, device=device) @ G_inv @ scale2d_inv(2, 2, device=device)
-            G_inv = translate2d(-0.5, -0.5, device=device) @ G_inv @ translate2d_inv(-0.5, -0.5, device=device)
-
-            # Execute transformation.
-            shape = [batch_size, num_channels, (height + Hz_pad * 2) * 2, (width + Hz_pad * 2) * 2]
-            G_inv = scale2d(2 / images.shape[3], 2 / images.shape[2], device=device) @ G_inv @ scale2d_inv(2 / shape[3], 2 / shape[2], device=device)
-            grid = torch.nn.functional.affine_grid(theta=G_inv[:,:2,:], size=shape, align_corners=False)
-            images = grid_sample_gradfix.grid_sample(images, grid)
-
-            # Downsample and crop.
-            images = upfirdn2d.downsample2d(x=images, f=self.Hz_geom, down=2, padding=-Hz_pad*2, flip_filter=True)
+            idx = nonidentity_indices(G_inv, I_3) if self.sparse and debug_percentile is None else None
+            images = apply_to_subset(self._run_geom, images, idx, G_inv)
 
         # --------------------------------------------
         # Select parameters for color transformations.
@@ -360,15 +351,8 @@ class AugmentPipe(torch.nn.Module):
 
         # Execute if the transform is not identity.
         if C is not I_4:
-            images = images.reshape([batch_size, num_channels, height * width])
-            if num_channels == 3:
-                images = C[:, :3, :3] @ images + C[:, :3, 3:]
-            elif num_channels == 1:
-                C = C[:, :3, :].mean(dim=1, keepdims=True)
-                images = images * C[:, :, :3].sum(dim=2, keepdims=True) + C[:, :, 3:]
-            else:
-                raise ValueError('Image must be RGB (3 channels) or L (1 channel)')
-            images = images.reshape([batch_size, num_channels, height, width])
+            idx = nonidentity_indices(C, I_4) if self.sparse and debug_percentile is None else None
+            images = apply_to_subset(self._run_color, images, idx, C)
 
         # ----------------------
         # Image-space filtering.
@@ -391,18 +375,9 @@ class AugmentPipe(torch.nn.Module):
                 t = t / (expected_power * t.square()).sum(dim=-1, keepdims=True).sqrt() # Normalize power.
                 g = g * t                                                               # Accumulate into global gain.
 
-            # Construct combined amplification filter.
-            Hz_prime = g @ self.Hz_fbank                                    # [batch, tap]
-            Hz_prime = Hz_prime.unsqueeze(1).repeat([1, num_channels, 1])   # [batch, channels, tap]
-            Hz_prime = Hz_prime.reshape([batch_size * num_channels, 1, -1]) # [batch * channels, 1, tap]
-
             # Apply filter.
-            p = self.Hz_fbank.shape[1] // 2
-            images = images.reshape([1, batch_size * num_channels, height, width])
-            images = torch.nn.functional.pad(input=images, pad=[p,p,p,p], mode='reflect')
-            images = conv2d_gradfix.conv2d(input=images, weight=Hz_prime.unsqueeze(2), groups=batch_size*num_channels)
-            images = conv2d_gradfix.conv2d(input=images, weight=Hz_prime.unsqueeze(3), groups=batch_size*num_channels)
-            images = images.reshape([batch_size, num_channels, height, width])
+            idx = nonidentity_indices(g, 1) if self.sparse and debug_percentile is None else None
+            images = apply_to_subset(self._run_imgfilter, images, idx, g)
 
         # ------------------------
         # Image-space corruptions.
@@ -433,4 +408,70 @@ class AugmentPipe(torch.nn.Module):
 
         return images
 
+    def _run_geom(self, images, G_inv):
+        batch_size, num_channels, height, width = images.shape
+        device = images.device
+
+        # Calculate padding.
+        cx = (width - 1) / 2
+        cy = (height - 1) / 2
+        cp = matrix([-cx, -cy, 1], [cx, -cy, 1], [cx, cy, 1], [-cx, cy, 1], device=device) # [idx, xyz]
+        cp = G_inv @ cp.t() # [batch, xyz, idx]
+        Hz_pad = self.Hz_geom.shape[0] // 4
+        margin = cp[:, :2, :].permute(1, 0, 2).flatten(1) # [xy, batch * idx]
+        margin = torch.cat([-margin, margin]).max(dim=1).values # [x0, y0, x1, y1]
+        margin = margin + misc.constant([Hz_pad * 2 - cx, Hz_pad * 2 - cy] * 2, device=device)
+        margin = margin.max(misc.constant([0, 0] * 2, device=device))
+        margin = margin.min(misc.constant([width-1, height-1] * 2, device=device))
+        mx0, my0, mx1, my1 = margin.ceil().to(torch.int32)
+
+        # Pad image and adjust origin.
+        images = torch.nn.functional.pad(input=images, pad=[mx0,mx1,my0,my1], mode='reflect')
+        G_inv = translate2d((mx0 - mx1) / 2, (my0 - my1) / 2) @ G_inv
+
+        # Upsample.
+        images = upfirdn2d.upsample2d(x=images, f=self.Hz_geom, up=2)
+        G_inv = scale2d(2, 2, device=device) @ G_inv @ scale2d_inv(2, 2, device=device)
+        G_inv = translate2d(-0.5, -0.5, device=device) @ G_inv @ translate2d_inv(-0.5, -0.5, device=device)
+
+        # Execute transformation.
+        shape = [batch_size, num_channels, (height + Hz_pad * 2) * 2, (width + Hz_pad * 2) * 2]
+        G_inv = scale2d(2 / images.shape[3], 2 / images.shape[2], device=device) @ G_inv @ scale2d_inv(2 / shape[3], 2 / shape[2], device=device)
+        grid = torch.nn.functional.affine_grid(theta=G_inv[:,:2,:], size=shape, align_corners=False)
+        images = grid_sample_gradfix.grid_sample(images, grid)
+
+        # Downsample and crop.
+        images = upfirdn2d.downsample2d(x=images, f=self.Hz_geom, down=2, padding=-Hz_pad*2, flip_filter=True)
+        return images
+
+    def _run_color(self, images, C):
+        batch_size, num_channels, height, width = images.shape
+        images = images.reshape([batch_size, num_channels, height * width])
+        if num_channels == 3:
+            images = C[:, :3, :3] @ images + C[:, :3, 3:]
+        elif num_channels == 1:
+            C = C[:, :3, :].mean(dim=1, keepdims=True)
+            images = images * C[:, :, :3].sum(dim=2, keepdims=True) + C[:, :, 3:]
+        else:
+            raise ValueError('Image must be RGB (3 channels) or L (1 channel)')
+        images = images.reshape([batch_size, num_channels, height, width])
+        return images
+
+    def _run_imgfilter(self, images, g):
+        batch_size, num_channels, height, width = images.shape
+
+        # Construct combined amplification filter.
+        Hz_prime = g @ self.Hz_fbank                                    # [batch, tap]
+        Hz_prime = Hz_prime.unsqueeze(1).repeat([1, num_channels, 1])   # [batch, channels, tap]
+        Hz_prime = Hz_prime.reshape([batch_size * num_channels, 1, -1]) # [batch * channels, 1, tap]
+
+        # Apply filter.
+        p = self.Hz_fbank.shape[1] // 2
+        images = images.reshape([1, batch_size * num_channels, height, width])
+        images = torch.nn.functional.pad(input=images, pad=[p,p,p,p], mode='reflect')
+        images = conv2d_gradfix.conv2d(input=images, weight=Hz_prime.unsqueeze(2), groups=batch_size*num_channels)
+        images = conv2d_gradfix.conv2d(input=images, weight=Hz_prime.unsqueeze(3), groups=batch_size*num_channels)
+        images = images.reshape([batch_size, num_channels, height, width])
+        return images
+
 #----------------------------------------------------------------------------
@@ -23,7 +23,7 @@ class Loss:
 #----------------------------------------------------------------------------
 
 class StyleGAN2Loss(Loss):
-    def __init__(self, device, G, D, augment_pipe=None, r1_gamma=10, style_mixing_prob=0, pl_weight=0, pl_batch_shrink=2, pl_decay=0.01, pl_no_weight_grad=False, blur_init_sigma=0, blur_fade_kimg=0):
+    def __init__(self, device, G, D, augment_pipe=None, r1_gamma=10, style_mixing_prob=0, pl_weight=0, pl_batch_shrink=2, pl_decay=0.01, pl_no_weight_grad=False, blur_init_sigma=0, blur_fade_kimg=0, reuse_gen=False, fuse_D=False):
         super().__init__()
         self.device             = device
         self.G                  = G
@@ -38,14 +38,22 @@ class StyleGAN2Loss(Loss):
         self.pl_mean            = torch.zeros([], device=device)
         self.blur_init_sigma    = blur_init_sigma
         self.blur_fade_kimg     = blur_fade_kimg
-
-    def run_G(self, z, c, update_emas=False):
-        ws = self.G.mapping(z, c, update_emas=update_emas)
-        if self.style_mixing_prob > 0:
+        self.reuse_gen          = reuse_gen
+        self.gen_stash          = [] # Detached (cur_nimg, img, c) from Gmain, consumed by Dmain when reuse_gen=True.
+        self.fuse_D             = fuse_D
+
+    def run_G(self, z, c, update_emas=False, ws_grad=False):
+        # Style mixing is decided on the host, so that the second set of latents is only
+        # mapped when the batch is actually mixed, in the same forward pass as the first.
+        if self.style_mixing_prob > 0 and float(torch.rand([])) < self.style_mixing_prob:
             with torch.autograd.profiler.record_function('style_mixing'):
-                cutoff = torch.empty([], dtype=torch.int64, device=ws.device).random_(1, ws.shape[1])
-                cutoff = torch.where(torch.rand([], device=ws.device) < self.style_mixing_prob, cutoff, torch.full_like(cutoff, ws.shape[1]))
-                ws[:, cutoff:] = self.G.mapping(torch.randn_like(z), c, update_emas=False)[:, cutoff:]
+                ws, ws_mix = self.G.mapping(torch.cat([z, torch.randn_like(z)]), torch.cat([c, c]), update_emas=update_emas).chunk(2)
+                cutoff = int(torch.randint(1, ws.shape[1], []))
+                ws = torch.cat([ws[:, :cutoff], ws_mix[:, cutoff:]], dim=1)
+        else:
+            ws = self.G.mapping(z, c, update_emas=update_emas)
+        if ws_grad and not ws.requires_grad: # e.g. frozen mapping network
+            ws = ws.detach().requires_grad_(True)
         img = self.G.synthesis(ws, update_emas=update_emas)
         return img, ws
 
@@ -60,6 +68,26 @@ class StyleGAN2Loss(Loss):
         logits = self.D(img, c, update_emas=update_emas)
         return logits
 
+    def get_D_pair_groups(self, batch_size):
+        # Number of minibatch std groups for a fused fake+real pass, or None if the
+        # groups cannot be kept identical to two separate passes.
+        mbstd = getattr(getattr(self.D, 'b4', None), 'mbstd', None)
+        if mbstd is None:
+            return 1
+        if mbstd.group_size is None or mbstd.group_size > batch_size or batch_size % mbstd.group_size != 0:
+            return None
+        return mbstd.group_size
+
+    def run_D_pair(self, gen_img, gen_c, real_img, real_c, groups, blur_sigma=0):
+        # Interleave the halves at group granularity, so that every minibatch std group
+        # contains the same images as in separate passes: [G, n] + [G, n] => [G, 2n].
+        n = gen_img.shape[0] // groups
+        def merge(a, b):
+            return torch.cat([a.reshape(groups, n, *a.shape[1:]), b.reshape(groups, n, *b.shape[1:])], dim=1).flatten(0, 1)
+        logits = self.run_D(merge(gen_img, real_img), merge(gen_c, real_c), blur_sigma=blur_sigma, update_emas=True)
+        logits = logits.reshape(groups, 2, n, *logits.shape[1:])
+        return logits[:, 0].flatten(0, 1), logits[:, 1].flatten(0, 1)
+
     def accumulate_gradients(self, phase, real_img, real_c, gen_z, gen_c, gain, cur_nimg):
         assert phase in ['Gmain', 'Greg', 'Gboth', 'Dmain', 'Dreg', 'Dboth']
         if self.pl_weight == 0:
@@ -67,11 +95,16 @@ class StyleGAN2Loss(Loss):
         if self.r1_gamma == 0:
             phase = {'Dreg': 'none', 'Dboth': 'Dmain'}.get(phase, phase)
         blur_sigma = max(1 - cur_nimg / (self.blur_fade_kimg * 1e3), 0) * self.blur_init_sigma if self.blur_fade_kimg > 0 else 0
+        pair_groups = None
+        if self.fuse_D and phase in ['Dmain', 'Dboth'] and gen_z.shape[0] == real_img.shape[0]:
+            pair_groups = self.get_D_pair_groups(gen_z.shape[0])
 
         # Gmain: Maximize logits for generated images.
         if phase in ['Gmain', 'Gboth']:
             with torch.autograd.profiler.record_function('Gmain_forward'):
-                gen_img, _gen_ws = self.run_G(gen_z, gen_c)
+                gen_img, _gen_ws = self.run_G(gen_z, gen_c, update_emas=self.reuse_gen)
+                if self.reuse_gen:
+                    self.gen_stash.append((cur_nimg, gen_img.detach(), gen_c))
                 gen_logits = self.run_D(gen_img, gen_c, blur_sigma=blur_sigma)
                 training_stats.report('Loss/scores/fake', gen_logits)
                 training_stats.report('Loss/signs/fake', gen_logits.sign())
@@ -84,7 +117,7 @@ class StyleGAN2Loss(Loss):
         if phase in ['Greg', 'Gboth']:
             with torch.autograd.profiler.record_function('Gpl_forward'):
                 batch_size = gen_z.shape[0] // self.pl_batch_shrink
-                gen_img, gen_ws = self.run_G(gen_z[:batch_size], gen_c[:batch_size])
+                gen_img, gen_ws = self.run_G(gen_z[:batch_size], gen_c[:batch_size], ws_grad=True)
                 pl_noise = torch.randn_like(gen_img) / np.sqrt(gen_img.shape[2] * gen_img.shape[3])
                 with torch.autograd.profiler.record_function('pl_grads'), conv2d_gradfix.no_weight_gradients(self.pl_no_weight_grad):
                     pl_grads = torch.autograd.grad(outputs=[(gen_img * pl_noise).sum()], inputs=[gen_ws], create_graph=True, only_inputs=True)[0]
@@ -102,13 +135,20 @@ class StyleGAN2Loss(Loss):
         loss_Dgen = 0
         if phase in ['Dmain', 'Dboth']:
             with torch.autograd.profiler.record_function('Dgen_forward'):
-                gen_img, _gen_ws = self.run_G(gen_z, gen_c, update_emas=True)
-                gen_logits = self.run_D(gen_img, gen_c, blur_sigma=blur_sigma, update_emas=True)
-                training_stats.report('Loss/scores/fake', gen_logits)
-                training_stats.report('Loss/signs/fake', gen_logits.sign())
-                loss_Dgen = torch.nn.functional.softplus(gen_logits) # -log(1 - sigmoid(gen_logits))
-            with torch.autograd.profiler.record_function('Dgen_backward'):
-                loss_Dgen.mean().mul(gain).backward()
+                while len(self.gen_stash) > 0 and self.gen_stash[0][0] != cur_nimg:
+                    self.gen_stash.pop(0) # stale
+                if len(self.gen_stash) > 0:
+                    _, gen_img, gen_c = self.gen_stash.pop(0)
+                else:
+                    gen_img, _gen_ws = self.run_G(gen_z, gen_c, update_emas=True)
+                if pair_groups is None:
+                    gen_logits = self.run_D(gen_img, gen_c, blur_sigma=blur_sigma, update_emas=True)
+                    training_stats.report('Loss/scores/fake', gen_logits)
+                    training_stats.report('Loss/signs/fake', gen_logits.sign())
+                    loss_Dgen = torch.nn.functional.softplus(gen_logits) # -log(1 - sigmoid(gen_logits))
+            if pair_groups is None:
+                with torch.autograd.profiler.record_function('Dgen_backward'):
+                    loss_Dgen.mean().mul(gain).backward()
 
         # Dmain: Maximize logits for real images.
         # Dr1: Apply R1 regularization.
@@ -116,7 +156,13 @@ class StyleGAN2Loss(Loss):
             name = 'Dreal' if phase == 'Dmain' else 'Dr1' if phase == 'Dreg' else 'Dreal_Dr1'
             with torch.autograd.profiler.record_function(name + '_forward'):
                 real_img_tmp = real_img.detach().requires_grad_(phase in ['Dreg', 'Dboth'])
-                real_logits = self.run_D(real_img_tmp, real_c, blur_sigma=blur_sigma)
+                if pair_groups is not None: # Dgen and Dreal in a single pass.
+                    gen_logits, real_logits = self.run_D_pair(gen_img, gen_c, real_img_tmp, real_c, groups=pair_groups, blur_sigma=blur_sigma)
+                    training_stats.report('Loss/scores/fake', gen_logits)
+                    training_stats.report('Loss/signs/fake', gen_logits.sign())
+                    loss_Dgen = torch.nn.functional.softplus(gen_logits) # -log(1 - sigmoid(gen_logits))
+                else:
+                    real_logits = self.run_D(real_img_tmp, real_c, blur_sigma=blur_sigma)
                 training_stats.report('Loss/scores/real', real_logits)
                 training_stats.report('Loss/signs/real', real_logits.sign())
 
@@ -135,6 +181,9 @@ class StyleGAN2Loss(Loss):
                     training_stats.report('Loss/D/reg', loss_Dr1)
 
             with torch.autograd.profiler.record_function(name + '_backward'):
-                (loss_Dreal + loss_Dr1).mean().mul(gain).backward()
+                loss_D = (loss_Dreal + loss_Dr1).mean()
+                if pair_groups is not None:
+                    loss_D = loss_D + loss_Dgen.mean()
+                loss_D.mul(gain).backward()
 
 #----------------------------------------------------------------------------
@@ -23,12 +23,13 @@ from torch_utils.ops import bias_act
 
 @misc.profiled_function
 def modulated_conv2d(
-    x,                  # Input tensor: [batch_size, in_channels, in_height, in_width]
-    w,                  # Weight tensor: [out_channels, in_channels, kernel_height, kernel_width]
-    s,                  # Style tensor: [batch_size, in_channels]
-    demodulate  = True, # Apply weight demodulation?
-    padding     = 0,    # Padding: int or [padH, padW]
-    input_gain  = None, # Optional scale factors for the input channels: [], [in_channels], or [batch_size, in_channels]
+    x,                      # Input tensor: [batch_size, in_channels, in_height, in_width]
+    w,                      # Weight tensor: [out_channels, in_channels, kernel_height, kernel_width]
+    s,                      # Style tensor: [batch_size, in_channels]
+    demodulate      = True, # Apply weight demodulation?
+    padding         = 0,    # Padding: int or [padH, padW]
+    input_gain      = None, # Optional scale factors for the input channels: [], [in_channels], or [batch_size, in_channels]
+    fused_modconv   = True, # Perform modulation, convolution, and demodulation as a single fused operation?
 ):
     with misc.suppress_tracer_warnings(): # this value will be treated as a constant
         batch_size = int(x.shape[0])
@@ -41,15 +42,28 @@ def modulated_conv2d(
     if demodulate:
         w = w * w.square().mean([1,2,3], keepdim=True).rsqrt()
         s = s * s.square().mean().rsqrt()
+    weight = w
 
     # Modulate weights.
     w = w.unsqueeze(0) # [NOIkk]
     w = w * s.unsqueeze(1).unsqueeze(3).unsqueeze(4) # [NOIkk]
 
     # Demodulate weights.
+    dcoefs = None
     if demodulate:
         dcoefs = (w.square().sum(dim=[2,3,4]) + 1e-8).rsqrt() # [NO]
-        w = w * dcoefs.unsqueeze(2).unsqueeze(3).unsqueeze(4) # [NOIkk]
+        if fused_modconv:
+            w = w * dcoefs.unsqueeze(2).unsqueeze(3).unsqueeze(4) # [NOIkk]
+
+    # Execute by scaling the activations before and after the convolution, which preserves their memory format.
+    if not fused_modconv:
+        if input_gain is not None:
+            s = s * input_gain.expand(batch_size, in_channels) # [NI]
+        x = x * s.to(x.dtype).reshape(batch_size, -1, 1, 1)
+        x = conv2d_gradfix.conv2d(input=x, weight=weight.to(x.dtype), padding=padding)
+        if demodulate:
+            x = x * dcoefs.to(x.dtype).reshape(batch_size, -1, 1, 1)
+        return x
 
     # Apply input scaling.
     if input_gain is not None:
@@ -276,12 +290,16 @@ class SynthesisLayer(torch.nn.Module):
         use_radial_filters  = False,    # Use radially symmetric downsampling filter? Ignored for critically sampled layers.
         conv_clamp          = 256,      # Clamp the output to [-X, +X], None = disable clamping.
         magnitude_ema_beta  = 0.999,    # Decay rate for the moving average of input magnitudes.
+        use_checkpoint      = False,    # Recompute the activations of this layer during backward instead of storing them?
+        channels_last       = False,    # Use channels-last memory format for the weights and activations?
     ):
         super().__init__()
         self.w_dim = w_dim
         self.is_torgb = is_torgb
         self.is_critically_sampled = is_critically_sampled
         self.use_fp16 = use_fp16
+        self.use_checkpoint = use_checkpoint
+        self.channels_last = channels_last
         self.in_channels = in_channels
         self.out_channels = out_channels
         self.in_size = np.broadcast_to(np.asarray(in_size), [2])
@@ -299,7 +317,8 @@ class SynthesisLayer(torch.nn.Module):
 
         # Setup parameters and buffers.
         self.affine = FullyConnectedLayer(self.w_dim, self.in_channels, bias_init=1)
-        self.weight = torch.nn.Parameter(torch.randn([self.out_channels, self.in_channels, self.conv_kernel, self.conv_kernel]))
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.weight = torch.nn.Parameter(torch.randn([self.out_channels, self.in_channels, self.conv_kernel, self.conv_kernel]).to(memory_format=memory_format))
         self.bias = torch.nn.Parameter(torch.zeros([self.out_channels]))
         self.register_buffer('magnitude_ema', torch.ones([]))
 
@@ -338,6 +357,19 @@ class SynthesisLayer(torch.nn.Module):
                 self.magnitude_ema.copy_(magnitude_cur.lerp(self.magnitude_ema, self.magnitude_ema_beta))
         input_gain = self.magnitude_ema.rsqrt()
 
+        # Execute the layer, keeping the magnitude EMA update above outside the recomputed region.
+        dtype = torch.float16 if (self.use_fp16 and not force_fp32 and x.device.type == 'cuda') else torch.float32
+        if self.use_checkpoint:
+            x = misc.checkpoint(self._forward, x, w, input_gain, dtype)
+        else:
+            x = self._forward(x, w, input_gain, dtype)
+
+        # Ensure correct shape and dtype.
+        misc.assert_shape(x, [None, self.out_channels, int(self.out_size[1]), int(self.out_size[0])])
+        assert x.dtype == dtype
+        return x
+
+    def _forward(self, x, w, input_gain, dtype):
         # Execute affine layer.
         styles = self.affine(w)
         if self.is_torgb:
@@ -345,19 +377,15 @@ class SynthesisLayer(torch.nn.Module):
             styles = styles * weight_gain
 
         # Execute modulated conv2d.
-        dtype = torch.float16 if (self.use_fp16 and not force_fp32 and x.device.type == 'cuda') else torch.float32
-        x = modulated_conv2d(x=x.to(dtype), w=self.weight, s=styles,
-            padding=self.conv_kernel-1, demodulate=(not self.is_torgb), input_gain=input_gain)
+        memory_format = torch.channels_last if self.channels_last else torch.preserve_format
+        x = modulated_conv2d(x=x.to(dtype=dtype, memory_format=memory_format), w=self.weight, s=styles,
+            padding=self.conv_kernel-1, demodulate=(not self.is_torgb), input_gain=input_gain, fused_modconv=(not self.channels_last))
 
         # Execute bias, filtered leaky ReLU, and clamping.
         gain = 1 if self.is_torgb else np.sqrt(2)
         slope = 1 if self.is_torgb else 0.2
         x = filtered_lrelu.filtered_lrelu(x=x, fu=self.up_filter, fd=self.down_filter, b=self.bias.to(x.dtype),
             up=self.up_factor, down=self.down_factor, padding=self.padding, gain=gain, slope=slope, clamp=self.conv_clamp)
-
-        # Ensure correct shape and dtype.
-        misc.assert_shape(x, [None, self.out_channels, int(self.out_size[1]), int(self.out_size[0])])
-        assert x.dtype == dtype
         return x
 
     @staticmethod
@@ -411,6 +439,7 @@ class SynthesisNetwork(torch.nn.Module):
         margin_size         = 10,       # Number of additional pixels outside the image.
         output_scale        = 0.25,     # Scale factor for the output image.
         num_fp16_res        = 4,        # Use FP16 for the N highest resolutions.
+        num_checkpoint_res  = 0,        # Use activation checkpointing for the N highest resolutions.
         **layer_kwargs,                 # Arguments for SynthesisLayer.
     ):
         super().__init__()
@@ -423,6 +452,7 @@ class SynthesisNetwork(torch.nn.Module):
         self.margin_size = margin_size
         self.output_scale = output_scale
         self.num_fp16_res = num_fp16_res
+        self.num_checkpoint_res = num_checkpoint_res
 
         # Geometric progression of layer cutoffs and min. stopbands.
         last_cutoff = self.img_resolution / 2 # f_{c,N}
@@ -449,8 +479,9 @@ class SynthesisNetwork(torch.nn.Module):
             is_torgb = (idx == self.num_layers)
             is_critically_sampled = (idx >= self.num_layers - self.num_critical)
             use_fp16 = (sampling_rates[idx] * (2 ** self.num_fp16_res) > self.img_resolution)
+            use_checkpoint = (sampling_rates[idx] * (2 ** self.num_checkpoint_res) > self.img_resolution)
             layer = SynthesisLayer(
-                w_dim=self.w_dim, is_torgb=is_torgb, is_critically_sampled=is_critically_sampled, use_fp16=use_fp16,
+                w_dim=self.w_dim, is_torgb=is_torgb, is_critically_sampled=is_critically_sampled, use_fp16=use_fp16, use_checkpoint=use_checkpoint,
                 in_channels=int(channels[prev]), out_channels= int(channels[idx]),
                 in_size=int(sizes[prev]), out_size=int(sizes[idx]),
                 in_sampling_rate=int(sampling_rates[prev]), out_sampling_rate=int(sampling_rates[idx]),
@@ -474,7 +505,7 @@ class SynthesisNetwork(torch.nn.Module):
 
         # Ensure correct shape and dtype.
         misc.assert_shape(x, [None, self.img_channels, self.img_resolution, self.img_resolution])
-        x = x.to(torch.float32)
+        x = x.to(dtype=torch.float32, memory_format=torch.contiguous_format)
         return x
 
     def extra_repr(self):
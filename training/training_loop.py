@@ -9,11 +9,14 @@
 """Main training loop."""
 
 import os
+import re
 import time
 import copy
 import json
 import pickle
+import hashlib
 import psutil
+import concurrent.futures
 import PIL.Image
 import numpy as np
 import torch
@@ -21,11 +24,16 @@ import dnnlib
 from dynamic_dataset.dynamic_dataset import DynamicDataset
 from torch_utils import misc
 from torch_utils import training_stats
+from torch_utils import distributed
+from torch_utils import timing
+from torch_utils import profiling
+from torch_utils import stats_server
 from torch_utils.ops import conv2d_gradfix
 from torch_utils.ops import grid_sample_gradfix
 
 import legacy
 from metrics import metric_main
+from metrics import metric_worker
 
 #----------------------------------------------------------------------------
 
@@ -82,6 +90,15 @@ def save_image_grid(img, fname, drange, grid_size, anamorphic=None):
     grid_pil = get_image_grid(img, drange, grid_size, anamorphic)
     grid_pil.save(fname)
 
+def save_image_grid_animation(frames, fname, drange, anamorphic=None, duration=400):
+    # frames: [(img, grid_size), ...], each frame downscaled by 2x.
+    pil_frames = []
+    for img, grid_size in frames:
+        grid_pil = get_image_grid(img, drange, grid_size, anamorphic)
+        pil_frames.append(grid_pil.resize(size=(grid_pil.width // 2, grid_pil.height // 2), resample=PIL.Image.LANCZOS))
+    first_frame = pil_frames.pop()
+    first_frame.save(fname, save_all=True, append_images=pil_frames, loop=0, duration=duration)
+
 #----------------------------------------------------------------------------
 
 def get_image_grid(img, drange, grid_size, anamorphic=None):
@@ -110,6 +127,119 @@ def get_image_grid(img, drange, grid_size, anamorphic=None):
 
     return pil_image
 
+#----------------------------------------------------------------------------
+# Cache for the sample image grid of the reals, used by fast_start. Keyed by
+# the dataset options and the list of image files, so that subsequent runs
+# on the same dataset can skip loading, grouping, and encoding the images.
+
+def get_snapshot_grid_cache_file(training_set, training_set_kwargs):
+    manifest = dict(kwargs=sorted(training_set_kwargs.items()), size=len(training_set), fnames=getattr(training_set, '_image_fnames', None))
+    md5 = hashlib.md5(repr(manifest).encode('utf-8'))
+    return dnnlib.make_cache_dir_path('snapshot-grids', f'{training_set.name}-{md5.hexdigest()}.pkl')
+
+def save_snapshot_grid_cache(cache_file, run_dir, fnames, grid_size, labels):
+    files = dict()
+    for fname in fnames:
+        with open(os.path.join(run_dir, fname), 'rb') as f:
+            files[fname] = f.read()
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = cache_file + '.' + str(os.getpid())
+    with open(temp_file, 'wb') as f:
+        pickle.dump(dict(grid_size=grid_size, labels=labels, files=files), f)
+    os.replace(temp_file, cache_file) # atomic
+
+#----------------------------------------------------------------------------
+# Statistics of one packed run for its own stats.jsonl: the statistics
+# reported under its prefix, with the prefix removed, plus the ones shared
+# by all runs.
+
+def get_packed_run_stats(stats_dict, run, runs):
+    if all(other.prefix == '' for other in runs): # not packed
+        return stats_dict
+    run_stats = dnnlib.EasyDict()
+    for name, value in stats_dict.items():
+        if name.startswith(run.prefix):
+            run_stats[name[len(run.prefix):]] = value
+        elif not any(name.startswith(other.prefix) for other in runs):
+            run_stats[name] = value
+    return run_stats
+
+#----------------------------------------------------------------------------
+# Pick the largest batch_gpu that fits in device memory by running every
+# training phase at increasing micro-batch sizes. The networks, the loss,
+# and the RNG states are restored afterwards, and all processes agree on
+# the result.
+
+def tune_batch_gpu(loss, phases, training_set, batch_gpu_max, device, num_gpus=1, min_batch=1, headroom=0.1, num_rounds=2):
+    modules = [loss.G, loss.D] + ([loss.augment_pipe] if loss.augment_pipe is not None else [])
+    buffers = [(buf, buf.detach().clone()) for module in modules for buf in module.buffers()]
+    if isinstance(getattr(loss, 'pl_mean', None), torch.Tensor):
+        buffers.append((loss.pl_mean, loss.pl_mean.detach().clone()))
+    rng_states = (np.random.get_state(), torch.get_rng_state(), torch.cuda.get_rng_state(device) if device.type == 'cuda' else None)
+    if device.type == 'cuda':
+        limit = torch.cuda.get_device_properties(device).total_memory * (1 - headroom)
+    else:
+        limit = psutil.virtual_memory().total * (1 - headroom)
+
+    candidates = [n for n in range(1, batch_gpu_max + 1) if batch_gpu_max % n == 0 and n % min_batch == 0]
+    assert len(candidates) > 0
+    selected = candidates[0]
+    measurements = []
+    for n in candidates:
+        peak = 0
+        oom = False
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+        try:
+            real_img = torch.rand([n, *training_set.image_shape], device=device) * 2 - 1
+            real_c = torch.zeros([n, training_set.label_dim], device=device)
+            gen_z = torch.randn([n, loss.G.z_dim], device=device)
+            for _round_idx in range(num_rounds):
+                for phase in phases:
+                    phase.grads.zero_()
+                    for param in phase.params:
+                        param.requires_grad_(True)
+                    loss.accumulate_gradients(phase=phase.name, real_img=real_img, real_c=real_c, gen_z=gen_z, gen_c=real_c, gain=phase.interval, cur_nimg=0)
+                    phase.module.requires_grad_(False)
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize(device)
+                    else:
+                        peak = max(peak, psutil.Process(os.getpid()).memory_info().rss)
+            if device.type == 'cuda':
+                peak = torch.cuda.max_memory_reserved(device)
+        except RuntimeError as err: # torch.cuda.OutOfMemoryError is a subclass
+            if 'out of memory' not in str(err):
+                raise
+            oom = True
+        for phase in phases:
+            phase.module.requires_grad_(False)
+        fits = torch.as_tensor([float(peak), float(oom or peak > limit)], dtype=torch.float64, device=device)
+        if num_gpus > 1:
+            torch.distributed.all_reduce(fits, op=torch.distributed.ReduceOp.MAX)
+        peak, oom = float(fits[0]), bool(fits[1])
+        measurements.append(dnnlib.EasyDict(batch_gpu=n, peak_mem_gb=round(peak / 2**30, 3), fits=(not oom)))
+        if oom:
+            break
+        selected = n
+
+    # Restore state.
+    if isinstance(getattr(loss, 'gen_stash', None), list):
+        loss.gen_stash.clear()
+    for module in [loss.G, loss.D]:
+        for param in module.parameters():
+            param.grad = None
+    for buf, value in buffers:
+        buf.copy_(value)
+    np.random.set_state(rng_states[0])
+    torch.set_rng_state(rng_states[1])
+    if rng_states[2] is not None:
+        torch.cuda.set_rng_state(rng_states[2], device)
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+    return selected, dnnlib.EasyDict(selected=selected, limit_gb=round(limit / 2**30, 3), headroom=headroom, measurements=measurements)
+
 #----------------------------------------------------------------------------
 
 def training_loop(
@@ -122,33 +252,64 @@ def training_loop(
     D_opt_kwargs            = {},       # Options for discriminator optimizer.
     augment_kwargs          = None,     # Options for augmentation pipeline. None = disable.
     loss_kwargs             = {},       # Options for loss function.
+    packed_runs             = None,     # Train several runs side by side on the same data, each given as a dict of overrides for loss_kwargs, G_opt_kwargs, D_opt_kwargs, and desc. None = single run.
     metrics                 = [],       # Metrics to evaluate during training.
+    metrics_async           = False,    # Evaluate metrics in a background process on rank 0 instead of blocking all ranks?
+    metrics_device          = None,     # Device for the background metric evaluation. None = same as training.
     random_seed             = 0,        # Global random seed.
     num_gpus                = 1,        # Number of GPUs participating in the training.
     rank                    = 0,        # Rank of the current process in [0, num_gpus[.
+    local_rank              = None,     # Index of the GPU to use within the current node, None = same as rank.
     batch_size              = 4,        # Total batch size for one training iteration. Can be larger than batch_gpu * num_gpus.
     batch_gpu               = 4,        # Number of samples processed at a time by one GPU.
+    batch_gpu_tune          = False,    # Reduce batch_gpu to the largest value that fits in memory, measured at startup?
+    batch_gpu_headroom      = 0.1,      # Fraction of device memory to leave unused when tuning batch_gpu.
     ema_kimg                = 10,       # Half-life of the exponential moving average (EMA) of generator weights.
     ema_rampup              = 0.05,     # EMA ramp-up coefficient. None = no rampup.
     G_reg_interval          = None,     # How often to perform regularization for G? None = disable lazy regularization.
     D_reg_interval          = 16,       # How often to perform regularization for D? None = disable lazy regularization.
+    G_freeze                = None,     # Regex of G parameter names to keep fixed, e.g. 'mapping\..*'. None = train all.
+    D_freeze                = None,     # Regex of D parameter names to keep fixed. None = train all.
     augment_p               = 0,        # Initial value of augmentation probability.
     ada_target              = None,     # ADA target value. None = fixed p.
     ada_interval            = 4,        # How often to perform ADA adjustment?
     ada_kimg                = 500,      # ADA adjustment speed, measured in how many kimg it takes for p to increase/decrease by one unit.
+    ada_async               = False,    # Adjust ADA on-device from statistics reduced asynchronously, one interval late?
     total_kimg              = 25000,    # Total length of the training, measured in thousands of real images.
     kimg_per_tick           = 4,        # Progress snapshot interval.
     image_snapshot_ticks    = 50,       # How often to save image snapshots? None = disable.
+    image_snapshot_batch    = None,     # Number of images to render at once for image snapshots. None = 4 * batch_gpu.
     network_snapshot_ticks  = 50,       # How often to save network snapshots? None = disable.
     resume_pkl              = None,     # Network pickle to resume training from.
     resume_kimg             = 0,        # First kimg to report when resuming training.
     cudnn_benchmark         = True,     # Enable torch.backends.cudnn.benchmark?
+    fast_start              = False,    # Cache the reals grid, skip summaries on resume, and overlap independent init steps?
+    grad_bucket_mb          = 25,       # Size of the persistent gradient buckets used for all-reduce, in megabytes.
+    grad_overlap            = False,    # Overlap gradient all-reduce with the backward pass of the last round?
+    shard_opt               = False,    # Shard optimizer state and update step across processes?
+    stats_max_pending       = None,     # Defer training_stats.report() and reduce up to this many values at once? None = disable.
+    wall_trace              = False,    # Export wall-clock timers of each rank as Chrome trace JSON?
+    profile_kimg            = None,     # Capture a torch.profiler window starting at this kimg? None = disable.
+    profile_steps           = 5,        # Number of training steps per profiler window.
+    profile_ticks           = None,     # Capture another profiler window every N ticks? None = only once.
+    profile_memory          = False,    # Record memory allocations in the profiler windows?
+    stats_port              = None,     # Serve the latest statistics of rank 0 over HTTP in Prometheus text format on this port. None = disable.
+    stats_host              = None,     # Interface for stats_port. None = localhost only.
     abort_fn                = None,     # Callback function for determining whether to abort training. Must return consistent results across ranks.
     progress_fn             = None,     # Callback function for updating training progress. Called for all ranks.
 ):
     # Initialize.
     start_time = time.time()
-    device = torch.device('cuda', rank)
+    startup_profile = dict() # stage => seconds, written to startup_profile.json
+    stage_start_time = [start_time]
+    def end_startup_stage(name):
+        now = time.time()
+        startup_profile[name] = round(now - stage_start_time[0], 3)
+        stage_start_time[0] = now
+    local_rank = rank if local_rank is None else local_rank
+    device = torch.device('cuda', local_rank) if torch.cuda.is_available() else torch.device('cpu')
+    if device.type == 'cuda':
+        torch.cuda.set_device(device)
     np.random.seed(random_seed * num_gpus + rank)
     torch.manual_seed(random_seed * num_gpus + rank)
     torch.backends.cudnn.benchmark = cudnn_benchmark    # Improves training speed.
@@ -156,6 +317,8 @@ def training_loop(
     torch.backends.cudnn.allow_tf32 = False             # Improves numerical accuracy.
     conv2d_gradfix.enabled = True                       # Improves training speed.
     grid_sample_gradfix.enabled = True                  # Avoids errors with the augmentation pipe.
+    training_stats.init_deferred(stats_max_pending)     # Reduces per-call overhead of report().
+    end_startup_stage('init')
 
     # Load training set.
     if rank == 0:
@@ -169,72 +332,189 @@ def training_loop(
         print('Image shape:', training_set.image_shape)
         print('Label shape:', training_set.label_shape)
         print()
+    end_startup_stage('training_set')
+
+    # Prepare the reals grid on rank 0, from the cache if possible. Encoding and
+    # saving happen in a background thread. With fast_start, the whole step runs
+    # in the background while the networks are being set up.
+    startup_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2) if fast_start else None
+    image_saver = None
+    image_futures = []
+    def export_reals():
+        cache_file = get_snapshot_grid_cache_file(training_set, training_set_kwargs) if fast_start else None
+        if cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                cache = pickle.load(f)
+            for fname, data in cache['files'].items():
+                with open(os.path.join(run_dir, fname), 'wb') as f:
+                    f.write(data)
+            return cache['grid_size'], cache['labels']
+        fnames = ['reals.jpg']
+        grid_size, images, labels = setup_snapshot_image_grid(training_set=training_set)
+        image_futures.append(image_saver.submit(save_image_grid, images, os.path.join(run_dir, 'reals.jpg'), drange=[0, 255], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic))
 
-    # Construct networks.
+        # Dynamic Dataset: generate animated `reals.gif`
+        if training_set_kwargs['class_name'] == 'dynamic_dataset.dynamic_dataset.DynamicDataset':
+            print('Dynamic Dataset: Exporting animated samples `reals_dynamic.webp`...')
+            frames = []
+            for r in range(0, 10):
+                grid_size, images, labels = setup_snapshot_image_grid(training_set=training_set)
+                frames.append((images, grid_size))
+            image_futures.append(image_saver.submit(save_image_grid_animation, frames, os.path.join(run_dir, 'reals_dynamic.webp'), drange=[0, 255], anamorphic=training_set_kwargs.anamorphic))
+            fnames.append('reals_dynamic.webp')
+
+        if cache_file is not None:
+            image_futures.append(image_saver.submit(save_snapshot_grid_cache, cache_file, run_dir, fnames, grid_size=grid_size, labels=labels))
+        return grid_size, labels
+    reals_future = None
+    if rank == 0:
+        image_saver = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        if startup_pool is not None:
+            reals_future = startup_pool.submit(export_reals)
+
+    # Load resume pickle, in the background with fast_start.
+    def load_resume_data():
+        with dnnlib.util.open_url(resume_pkl) as f:
+            return legacy.load_network_pkl(f)
+    resume_future = None
+    if (resume_pkl is not None) and (rank == 0) and (startup_pool is not None):
+        resume_future = startup_pool.submit(load_resume_data)
+
+    # Construct networks, one set per packed run.
     if rank == 0:
         print('Constructing networks...')
     common_kwargs = dict(c_dim=training_set.label_dim, img_resolution=training_set.resolution, img_channels=training_set.num_channels)
-    G = dnnlib.util.construct_class_by_name(**G_kwargs, **common_kwargs).train().requires_grad_(False).to(device) # subclass of torch.nn.Module
-    D = dnnlib.util.construct_class_by_name(**D_kwargs, **common_kwargs).train().requires_grad_(False).to(device) # subclass of torch.nn.Module
-    G_ema = copy.deepcopy(G).eval()
+    runs = []
+    for run_idx, overrides in enumerate(packed_runs if packed_runs is not None else [dict()]):
+        run = dnnlib.EasyDict(idx=run_idx, prefix='', run_dir=run_dir)
+        if packed_runs is not None:
+            torch.manual_seed(random_seed * num_gpus + rank) # Start every run from the same initialization.
+            run.prefix = f'run{run_idx:02d}/'
+            run.run_dir = os.path.join(run_dir, f'run{run_idx:02d}' + (f'-{overrides["desc"]}' if overrides.get('desc') else ''))
+            if rank == 0:
+                os.makedirs(run.run_dir, exist_ok=True)
+                with open(os.path.join(run.run_dir, 'run_options.json'), 'wt') as f:
+                    json.dump(overrides, f, indent=2)
+        run.loss_kwargs = dnnlib.EasyDict(loss_kwargs, **overrides.get('loss_kwargs', {}))
+        run.G_opt_kwargs = dnnlib.EasyDict(G_opt_kwargs, **overrides.get('G_opt_kwargs', {}))
+        run.D_opt_kwargs = dnnlib.EasyDict(D_opt_kwargs, **overrides.get('D_opt_kwargs', {}))
+        run.G = dnnlib.util.construct_class_by_name(**G_kwargs, **common_kwargs).train().requires_grad_(False).to(device) # subclass of torch.nn.Module
+        run.D = dnnlib.util.construct_class_by_name(**D_kwargs, **common_kwargs).train().requires_grad_(False).to(device) # subclass of torch.nn.Module
+        run.G_ema = copy.deepcopy(run.G).eval()
+        runs.append(run)
+    end_startup_stage('networks')
 
     # Resume from existing pickle.
     if (resume_pkl is not None) and (rank == 0):
         print(f'Resuming from "{resume_pkl}"')
-        with dnnlib.util.open_url(resume_pkl) as f:
-            resume_data = legacy.load_network_pkl(f)
-        for name, module in [('G', G), ('D', D), ('G_ema', G_ema)]:
-            misc.copy_params_and_buffers(resume_data[name], module, require_all=False)
-
-    # Print network summary tables.
-    if rank == 0:
-        z = torch.empty([batch_gpu, G.z_dim], device=device)
-        c = torch.empty([batch_gpu, G.c_dim], device=device)
-        img = misc.print_module_summary(G, [z, c])
-        misc.print_module_summary(D, [img, c])
+        resume_data = resume_future.result() if resume_future is not None else load_resume_data()
+        for run in runs:
+            for name, module in [('G', run.G), ('D', run.D), ('G_ema', run.G_ema)]:
+                misc.copy_params_and_buffers(resume_data[name], module, require_all=False)
+        del resume_data # conserve memory
+    end_startup_stage('resume')
+
+    # Print network summary tables. Redundant when resuming with fast_start.
+    if (rank == 0) and not (fast_start and resume_pkl is not None):
+        z = torch.empty([batch_gpu, runs[0].G.z_dim], device=device)
+        c = torch.empty([batch_gpu, runs[0].G.c_dim], device=device)
+        img = misc.print_module_summary(runs[0].G, [z, c])
+        misc.print_module_summary(runs[0].D, [img, c])
+    end_startup_stage('summary')
 
     # Setup augmentation.
     if rank == 0:
         print('Setting up augmentation...')
-    augment_pipe = None
-    ada_stats = None
-    if (augment_kwargs is not None) and (augment_p > 0 or ada_target is not None):
-        augment_pipe = dnnlib.util.construct_class_by_name(**augment_kwargs).train().requires_grad_(False).to(device) # subclass of torch.nn.Module
-        augment_pipe.p.copy_(torch.as_tensor(augment_p))
-        if ada_target is not None:
-            ada_stats = training_stats.Collector(regex='Loss/signs/real')
+    for run in runs:
+        run.augment_pipe = None
+        run.ada_stats = None
+        if (augment_kwargs is not None) and (augment_p > 0 or ada_target is not None):
+            run.augment_pipe = dnnlib.util.construct_class_by_name(**augment_kwargs).train().requires_grad_(False).to(device) # subclass of torch.nn.Module
+            run.augment_pipe.p.copy_(torch.as_tensor(augment_p))
+            if ada_target is not None and ada_async:
+                run.ada_stats = training_stats.DeviceCollector(run.prefix + 'Loss/signs/real', device=device)
+            elif ada_target is not None:
+                run.ada_stats = training_stats.Collector(regex=re.escape(run.prefix) + 'Loss/signs/real')
+    end_startup_stage('augment')
 
     # Distribute across GPUs.
     if rank == 0:
         print(f'Distributing across {num_gpus} GPUs...')
-    for module in [G, D, G_ema, augment_pipe]:
-        if module is not None and num_gpus > 1:
-            for param in misc.params_and_buffers(module):
-                torch.distributed.broadcast(param, src=0)
+    for run in runs:
+        for module in [run.G, run.D, run.G_ema, run.augment_pipe]:
+            if module is not None and num_gpus > 1:
+                for param in misc.params_and_buffers(module):
+                    torch.distributed.broadcast(param, src=0)
+    end_startup_stage('distribute')
 
     # Setup training phases.
     if rank == 0:
         print('Setting up training phases...')
-    loss = dnnlib.util.construct_class_by_name(device=device, G=G, D=D, augment_pipe=augment_pipe, **loss_kwargs) # subclass of training.loss.Loss
+    def construct_optimizer(params, opt_kwargs):
+        if shard_opt and num_gpus > 1:
+            return distributed.ShardedOptimizer(params, num_gpus=num_gpus, rank=rank, **opt_kwargs)
+        return dnnlib.util.construct_class_by_name(params=params, **opt_kwargs) # subclass of torch.optim.Optimizer
+    def get_trainable_params(name, module, freeze):
+        params = list(module.named_parameters())
+        trainable = [param for param_name, param in params if freeze is None or re.fullmatch(freeze, param_name) is None]
+        if rank == 0 and freeze is not None:
+            frozen_numel = sum(param.numel() for _param_name, param in params) - sum(param.numel() for param in trainable)
+            print(f'Freezing {len(params) - len(trainable)} of {len(params)} {name} parameter tensors ({frozen_numel} values).')
+        if len(trainable) == 0:
+            raise ValueError(f'{name}_freeze matches all parameters of {name}')
+        return trainable
     phases = []
-    for name, module, opt_kwargs, reg_interval in [('G', G, G_opt_kwargs, G_reg_interval), ('D', D, D_opt_kwargs, D_reg_interval)]:
-        if reg_interval is None:
-            opt = dnnlib.util.construct_class_by_name(params=module.parameters(), **opt_kwargs) # subclass of torch.optim.Optimizer
-            phases += [dnnlib.EasyDict(name=name+'both', module=module, opt=opt, interval=1)]
-        else: # Lazy regularization.
-            mb_ratio = reg_interval / (reg_interval + 1)
-            opt_kwargs = dnnlib.EasyDict(opt_kwargs)
-            opt_kwargs.lr = opt_kwargs.lr * mb_ratio
-            opt_kwargs.betas = [beta ** mb_ratio for beta in opt_kwargs.betas]
-            opt = dnnlib.util.construct_class_by_name(module.parameters(), **opt_kwargs) # subclass of torch.optim.Optimizer
-            phases += [dnnlib.EasyDict(name=name+'main', module=module, opt=opt, interval=1)]
-            phases += [dnnlib.EasyDict(name=name+'reg', module=module, opt=opt, interval=reg_interval)]
-    for phase in phases:
-        phase.start_event = None
-        phase.end_event = None
+    for run in runs:
+        run.loss = dnnlib.util.construct_class_by_name(device=device, G=run.G, D=run.D, augment_pipe=run.augment_pipe, **run.loss_kwargs) # subclass of training.loss.Loss
+        run.phases = []
+        for name, module, opt_kwargs, reg_interval, freeze in [('G', run.G, run.G_opt_kwargs, G_reg_interval, G_freeze), ('D', run.D, run.D_opt_kwargs, D_reg_interval, D_freeze)]:
+            params = get_trainable_params(name, module, freeze) # frozen parameters get neither gradients, all-reduce, nor optimizer state
+            grads = distributed.GradBuckets(params, bucket_cap_mb=grad_bucket_mb) # persistent gradient storage shared by all phases of the module
+            if reg_interval is None:
+                opt = construct_optimizer(params, opt_kwargs)
+                run.phases += [dnnlib.EasyDict(name=name+'both', module=module, params=params, opt=opt, grads=grads, interval=1)]
+            else: # Lazy regularization.
+                mb_ratio = reg_interval / (reg_interval + 1)
+                opt_kwargs = dnnlib.EasyDict(opt_kwargs)
+                opt_kwargs.lr = opt_kwargs.lr * mb_ratio
+                opt_kwargs.betas = [beta ** mb_ratio for beta in opt_kwargs.betas]
+                opt = construct_optimizer(params, opt_kwargs)
+                run.phases += [dnnlib.EasyDict(name=name+'main', module=module, params=params, opt=opt, grads=grads, interval=1)]
+                run.phases += [dnnlib.EasyDict(name=name+'reg', module=module, params=params, opt=opt, grads=grads, interval=reg_interval)]
+        for phase in run.phases:
+            phase.run = run
+            phase.start_event = None
+            phase.end_event = None
+            if rank == 0 and device.type == 'cuda':
+                phase.start_event = torch.cuda.Event(enable_timing=True)
+                phase.end_event = torch.cuda.Event(enable_timing=True)
+        phases += run.phases
+    end_startup_stage('phases')
+
+    # Tune batch size per GPU.
+    if batch_gpu_tune:
+        assert len(runs) == 1, 'batch_gpu_tune is not supported with packed_runs'
         if rank == 0:
-            phase.start_event = torch.cuda.Event(enable_timing=True)
-            phase.end_event = torch.cuda.Event(enable_timing=True)
+            print('Tuning batch size per GPU...')
+        mbstd_group = D_kwargs.get('epilogue_kwargs', {}).get('mbstd_group_size', None) or 1
+        batch_gpu, tuning = tune_batch_gpu(loss=runs[0].loss, phases=phases, training_set=training_set, batch_gpu_max=batch_gpu,
+            device=device, num_gpus=num_gpus, min_batch=mbstd_group, headroom=batch_gpu_headroom)
+        training_stats.discard() # drop the losses and signs reported by the probe
+        if isinstance(runs[0].ada_stats, training_stats.DeviceCollector):
+            runs[0].ada_stats.reset()
+        if rank == 0:
+            for m in tuning.measurements:
+                print(f'batch_gpu {m.batch_gpu:<4d} peak {m.peak_mem_gb:<8.2f} GB  {"ok" if m.fits else "too large"}')
+            print(f'Selected batch_gpu = {batch_gpu}')
+            options_file = os.path.join(run_dir, 'training_options.json')
+            if os.path.isfile(options_file):
+                with open(options_file, 'rt') as f:
+                    options = json.load(f)
+                options['batch_gpu'] = batch_gpu
+                options['batch_gpu_tuning'] = tuning
+                with open(options_file, 'wt') as f:
+                    json.dump(options, f, indent=2)
+    end_startup_stage('tune_batch')
 
     # Export sample images.
     grid_size = None
@@ -242,44 +522,57 @@ def training_loop(
     grid_c = None
     if rank == 0:
         print('Exporting sample images...')
-        grid_size, images, labels = setup_snapshot_image_grid(training_set=training_set)
-        save_image_grid(images, os.path.join(run_dir, 'reals.jpg'), drange=[0, 255], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic)
-
-        # Dynamic Dataset: generate animated `reals.gif`
-        if training_set_kwargs['class_name'] == 'dynamic_dataset.dynamic_dataset.DynamicDataset':
-            print('Dynamic Dataset: Exporting animated samples `reals_dynamic.webp`...')
-            frames = []
-            for r in range(0, 10):
-                grid_size, images, labels = setup_snapshot_image_grid(training_set=training_set)
-                reals_image = get_image_grid(images, drange=[0, 255], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic)
-                reals_image = reals_image.resize(size=(reals_image.width // 2, reals_image.height // 2), resample=PIL.Image.LANCZOS)  # Reduce size
-                frames.append(reals_image)
-            first_frame = frames.pop()
-            first_frame.save(os.path.join(run_dir, 'reals_dynamic.webp'), save_all=True, append_images=frames, loop=0, duration=400)
-
-        grid_z = torch.randn([labels.shape[0], G.z_dim], device=device).split(batch_gpu)
-        grid_c = torch.from_numpy(labels).to(device).split(batch_gpu)
-        images = torch.cat([G_ema(z=z, c=c, noise_mode='const').cpu() for z, c in zip(grid_z, grid_c)]).numpy()
-        save_image_grid(images, os.path.join(run_dir, 'fakes_init.jpg'), drange=[-1,1], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic)
+        grid_size, labels = reals_future.result() if reals_future is not None else export_reals()
+        image_batch = image_snapshot_batch if image_snapshot_batch is not None else batch_gpu * 4
+        grid_z = torch.randn([labels.shape[0], runs[0].G.z_dim], device=device).split(image_batch)
+        grid_c = torch.from_numpy(labels).to(device).split(image_batch)
+        for run in runs:
+            images = torch.cat([run.G_ema(z=z, c=c, noise_mode='const').cpu() for z, c in zip(grid_z, grid_c)]).numpy()
+            image_futures.append(image_saver.submit(save_image_grid, images, os.path.join(run.run_dir, 'fakes_init.jpg'), drange=[-1,1], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic))
+    if startup_pool is not None:
+        startup_pool.shutdown(wait=True)
+    end_startup_stage('sample_images')
 
     # Initialize logs.
     if rank == 0:
         print('Initializing logs...')
     stats_collector = training_stats.Collector(regex='.*')
-    stats_metrics = dict()
-    stats_jsonl = None
-    stats_tfevents = None
+    stats_worker = None
+    if metrics_async and (rank == 0) and (len(metrics) > 0):
+        assert len(runs) == 1, 'metrics_async is not supported with packed_runs'
+        stats_worker = metric_worker.MetricWorker(metrics=metrics, dataset_kwargs=training_set_kwargs, run_dir=run_dir,
+            device=(metrics_device if metrics_device is not None else device))
+    for run in runs:
+        run.stats_metrics = dict()
+        run.stats_jsonl = None
+        run.stats_tfevents = None
+        if rank == 0:
+            run.stats_jsonl = open(os.path.join(run.run_dir, 'stats.jsonl'), 'wt')
+            # try:
+            #     import torch.utils.tensorboard as tensorboard
+            #     run.stats_tfevents = tensorboard.SummaryWriter(run.run_dir)
+            # except ImportError as err:
+            #     print('Skipping tfevents export:', err)
+    phase_names = list(dict.fromkeys(phase.name for phase in phases))
+    wall_timers = timing.WallTimers(names=['data_wait', 'data_h2d'] + phase_names + ['opt', 'Gema', 'image_snapshot', 'network_snapshot', 'metrics'],
+        trace_file=(os.path.join(run_dir, f'wall_trace_rank{rank}.json') if wall_trace else None), pid=rank)
+    profiler_windows = None
+    if profile_kimg is not None:
+        profiler_windows = profiling.ProfilerWindows(run_dir=run_dir, start_kimg=profile_kimg, num_steps=profile_steps,
+            every_ticks=profile_ticks, profile_memory=profile_memory, rank=rank, device=device)
+    stats_endpoint = None
+    if stats_port is not None and rank == 0:
+        stats_endpoint = stats_server.StatsServer(port=stats_port, host=(stats_host or '127.0.0.1'))
+        print(f'Serving statistics at http://{stats_host or "127.0.0.1"}:{stats_endpoint.port}/metrics')
+    end_startup_stage('logs')
     if rank == 0:
-        stats_jsonl = open(os.path.join(run_dir, 'stats.jsonl'), 'wt')
-        # try:
-        #     import torch.utils.tensorboard as tensorboard
-        #     stats_tfevents = tensorboard.SummaryWriter(run_dir)
-        # except ImportError as err:
-        #     print('Skipping tfevents export:', err)
+        startup_profile['total'] = round(time.time() - start_time, 3)
+        with open(os.path.join(run_dir, 'startup_profile.json'), 'wt') as f:
+            json.dump(startup_profile, f, indent=2)
 
     # Train.
     if rank == 0:
-        print(f'Training for {total_kimg} kimg...')
+        print(f'Training for {total_kimg} kimg' + (f' with {len(runs)} packed runs' if packed_runs is not None else '') + '...')
         print()
     cur_nimg = resume_kimg * 1000
     cur_tick = 0
@@ -290,44 +583,44 @@ def training_loop(
     if progress_fn is not None:
         progress_fn(0, total_kimg)
     while True:
+        if profiler_windows is not None:
+            profiler_windows.begin_step(cur_nimg=cur_nimg, cur_tick=cur_tick)
 
-        # Fetch training data.
+        # Fetch training data, shared by all packed runs.
         with torch.autograd.profiler.record_function('data_fetch'):
-            phase_real_img, phase_real_c = next(training_set_iterator)
+            with wall_timers('data_wait'):
+                phase_real_img, phase_real_c = next(training_set_iterator)
+        with torch.autograd.profiler.record_function('data_fetch'), wall_timers('data_h2d'):
             phase_real_img = (phase_real_img.to(device).to(torch.float32) / 127.5 - 1).split(batch_gpu)
             phase_real_c = phase_real_c.to(device).split(batch_gpu)
-            all_gen_z = torch.randn([len(phases) * batch_size, G.z_dim], device=device)
+            all_gen_z = torch.randn([len(runs[0].phases) * batch_size, runs[0].G.z_dim], device=device) # shared by all packed runs
             all_gen_z = [phase_gen_z.split(batch_gpu) for phase_gen_z in all_gen_z.split(batch_size)]
-            all_gen_c = [training_set.get_label(np.random.randint(len(training_set))) for _ in range(len(phases) * batch_size)]
-            all_gen_c = torch.from_numpy(np.stack(all_gen_c)).pin_memory().to(device)
+            all_gen_c = [training_set.get_label(np.random.randint(len(training_set))) for _ in range(len(runs[0].phases) * batch_size)]
+            all_gen_c = torch.from_numpy(np.stack(all_gen_c))
+            all_gen_c = (all_gen_c.pin_memory() if device.type == 'cuda' else all_gen_c).to(device)
             all_gen_c = [phase_gen_c.split(batch_gpu) for phase_gen_c in all_gen_c.split(batch_size)]
 
         # Execute training phases.
-        for phase, phase_gen_z, phase_gen_c in zip(phases, all_gen_z, all_gen_c):
+        for phase, phase_gen_z, phase_gen_c in zip(phases, all_gen_z * len(runs), all_gen_c * len(runs)):
             if batch_idx % phase.interval != 0:
                 continue
             if phase.start_event is not None:
                 phase.start_event.record(torch.cuda.current_stream(device))
 
             # Accumulate gradients.
-            phase.opt.zero_grad(set_to_none=True)
-            phase.module.requires_grad_(True)
-            for real_img, real_c, gen_z, gen_c in zip(phase_real_img, phase_real_c, phase_gen_z, phase_gen_c):
-                loss.accumulate_gradients(phase=phase.name, real_img=real_img, real_c=real_c, gen_z=gen_z, gen_c=gen_c, gain=phase.interval, cur_nimg=cur_nimg)
-            phase.module.requires_grad_(False)
+            with wall_timers(phase.name), training_stats.name_prefix(phase.run.prefix):
+                phase.grads.zero_()
+                for param in phase.params:
+                    param.requires_grad_(True)
+                for round_idx, (real_img, real_c, gen_z, gen_c) in enumerate(zip(phase_real_img, phase_real_c, phase_gen_z, phase_gen_c)):
+                    if grad_overlap and num_gpus > 1 and round_idx == len(phase_real_img) - 1:
+                        phase.grads.arm(phase.name, num_gpus=num_gpus)
+                    phase.run.loss.accumulate_gradients(phase=phase.name, real_img=real_img, real_c=real_c, gen_z=gen_z, gen_c=gen_c, gain=phase.interval, cur_nimg=cur_nimg)
+                phase.module.requires_grad_(False)
 
             # Update weights.
-            with torch.autograd.profiler.record_function(phase.name + '_opt'):
-                params = [param for param in phase.module.parameters() if param.grad is not None]
-                if len(params) > 0:
-                    flat = torch.cat([param.grad.flatten() for param in params])
-                    if num_gpus > 1:
-                        torch.distributed.all_reduce(flat)
-                        flat /= num_gpus
-                    misc.nan_to_num(flat, nan=0, posinf=1e5, neginf=-1e5, out=flat)
-                    grads = flat.split([param.numel() for param in params])
-                    for param, grad in zip(params, grads):
-                        param.grad = grad.reshape(param.shape)
+            with torch.autograd.profiler.record_function(phase.name + '_opt'), wall_timers('opt'):
+                phase.grads.all_reduce_(num_gpus=num_gpus, nan=0, posinf=1e5, neginf=-1e5)
                 phase.opt.step()
 
             # Phase done.
@@ -335,25 +628,35 @@ def training_loop(
                 phase.end_event.record(torch.cuda.current_stream(device))
 
         # Update G_ema.
-        with torch.autograd.profiler.record_function('Gema'):
+        with torch.autograd.profiler.record_function('Gema'), wall_timers('Gema'):
             ema_nimg = ema_kimg * 1000
             if ema_rampup is not None:
                 ema_nimg = min(ema_nimg, cur_nimg * ema_rampup)
             ema_beta = 0.5 ** (batch_size / max(ema_nimg, 1e-8))
-            for p_ema, p in zip(G_ema.parameters(), G.parameters()):
-                p_ema.copy_(p.lerp(p_ema, ema_beta))
-            for b_ema, b in zip(G_ema.buffers(), G.buffers()):
-                b_ema.copy_(b)
+            for run in runs:
+                for p_ema, p in zip(run.G_ema.parameters(), run.G.parameters()):
+                    p_ema.copy_(p.lerp(p_ema, ema_beta))
+                for b_ema, b in zip(run.G_ema.buffers(), run.G.buffers()):
+                    b_ema.copy_(b)
 
         # Update state.
         cur_nimg += batch_size
         batch_idx += 1
 
         # Execute ADA heuristic.
-        if (ada_stats is not None) and (batch_idx % ada_interval == 0):
-            ada_stats.update()
-            adjust = np.sign(ada_stats['Loss/signs/real'] - ada_target) * (batch_size * ada_interval) / (ada_kimg * 1000)
-            augment_pipe.p.copy_((augment_pipe.p + adjust).max(misc.constant(0, device=device)))
+        for run in runs:
+            if (run.ada_stats is not None) and (batch_idx % ada_interval == 0) and ada_async:
+                moments = run.ada_stats.update()
+                if moments is not None: # [num, sum, sum_of_squares] from the previous interval, kept on-device.
+                    adjust = torch.where(moments[0] > 0, torch.sign(moments[1] / moments[0].clamp(min=1) - ada_target), torch.zeros_like(moments[0]))
+                    adjust = adjust.to(torch.float32) * ((batch_size * ada_interval) / (ada_kimg * 1000))
+                    run.augment_pipe.p.copy_((run.augment_pipe.p + adjust).max(misc.constant(0, device=device)))
+            elif (run.ada_stats is not None) and (batch_idx % ada_interval == 0):
+                run.ada_stats.update()
+                adjust = np.sign(run.ada_stats[run.prefix + 'Loss/signs/real'] - ada_target) * (batch_size * ada_interval) / (ada_kimg * 1000)
+                run.augment_pipe.p.copy_((run.augment_pipe.p + adjust).max(misc.constant(0, device=device)))
+        if profiler_windows is not None:
+            profiler_windows.end_step()
 
         # Perform maintenance tasks once per tick.
         done = (cur_nimg >= total_kimg * 1000)
@@ -370,10 +673,15 @@ def training_loop(
         fields += [f"sec/kimg {training_stats.report0('Timing/sec_per_kimg', (tick_end_time - tick_start_time) / (cur_nimg - tick_start_nimg) * 1e3):<7.2f}"]
         fields += [f"maintenance {training_stats.report0('Timing/maintenance_sec', maintenance_time):<6.1f}"]
         fields += [f"cpumem {training_stats.report0('Resources/cpu_mem_gb', psutil.Process(os.getpid()).memory_info().rss / 2**30):<6.2f}"]
-        fields += [f"gpumem {training_stats.report0('Resources/peak_gpu_mem_gb', torch.cuda.max_memory_allocated(device) / 2**30):<6.2f}"]
-        fields += [f"reserved {training_stats.report0('Resources/peak_gpu_mem_reserved_gb', torch.cuda.max_memory_reserved(device) / 2**30):<6.2f}"]
-        torch.cuda.reset_peak_memory_stats()
-        fields += [f"augment {training_stats.report0('Progress/augment', float(augment_pipe.p.cpu()) if augment_pipe is not None else 0):.3f}"]
+        if device.type == 'cuda':
+            fields += [f"gpumem {training_stats.report0('Resources/peak_gpu_mem_gb', torch.cuda.max_memory_allocated(device) / 2**30):<6.2f}"]
+            fields += [f"reserved {training_stats.report0('Resources/peak_gpu_mem_reserved_gb', torch.cuda.max_memory_reserved(device) / 2**30):<6.2f}"]
+            torch.cuda.reset_peak_memory_stats()
+        augment = []
+        for run in runs:
+            with training_stats.name_prefix(run.prefix):
+                augment.append(training_stats.report0('Progress/augment', float(run.augment_pipe.p.cpu()) if run.augment_pipe is not None else 0))
+        fields += [f"augment {','.join(f'{p:.3f}' for p in augment)}"]
         training_stats.report0('Timing/total_hours', (tick_end_time - start_time) / (60 * 60))
         training_stats.report0('Timing/total_days', (tick_end_time - start_time) / (24 * 60 * 60))
         if rank == 0:
@@ -388,64 +696,87 @@ def training_loop(
 
         # Save image snapshot.
         if (rank == 0) and (image_snapshot_ticks is not None) and (done or cur_tick % image_snapshot_ticks == 0):
-            images = torch.cat([G_ema(z=z, c=c, noise_mode='const').cpu() for z, c in zip(grid_z, grid_c)]).numpy()
-            save_image_grid(images, os.path.join(run_dir, f'fakes{cur_nimg//1000:06d}.jpg'), drange=[-1,1], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic)
-
-        # Save network snapshot.
-        snapshot_pkl = None
-        snapshot_data = None
-        if (network_snapshot_ticks is not None) and (done or cur_tick % network_snapshot_ticks == 0):
-            snapshot_data = dict(G=G, D=D, G_ema=G_ema, augment_pipe=augment_pipe, training_set_kwargs=dict(training_set_kwargs))
-            for key, value in snapshot_data.items():
-                if isinstance(value, torch.nn.Module):
-                    value = copy.deepcopy(value).eval().requires_grad_(False)
-                    if num_gpus > 1:
-                        misc.check_ddp_consistency(value, ignore_regex=r'.*\.[^.]+_(avg|ema)')
-                        for param in misc.params_and_buffers(value):
-                            torch.distributed.broadcast(param, src=0)
-                    snapshot_data[key] = value.cpu()
-                del value # conserve memory
-            snapshot_pkl = os.path.join(run_dir, f'network-snapshot-{cur_nimg//1000:06d}.pkl')
-            if rank == 0:
-                with open(snapshot_pkl, 'wb') as f:
-                    pickle.dump(snapshot_data, f)
-
-        # Evaluate metrics.
-        if (snapshot_data is not None) and (len(metrics) > 0):
-            if rank == 0:
-                print('Evaluating metrics...')
-            for metric in metrics:
-                result_dict = metric_main.calc_metric(metric=metric, G=snapshot_data['G_ema'],
-                    dataset_kwargs=training_set_kwargs, num_gpus=num_gpus, rank=rank, device=device)
-                if rank == 0:
-                    metric_main.report_metric(result_dict, run_dir=run_dir, snapshot_pkl=snapshot_pkl)
-                stats_metrics.update(result_dict.results)
-        del snapshot_data # conserve memory
+            with wall_timers('image_snapshot'):
+                for run in runs:
+                    images = torch.cat([run.G_ema(z=z, c=c, noise_mode='const').cpu() for z, c in zip(grid_z, grid_c)]).numpy()
+                    image_futures.append(image_saver.submit(save_image_grid, images, os.path.join(run.run_dir, f'fakes{cur_nimg//1000:06d}.jpg'), drange=[-1,1], grid_size=grid_size, anamorphic=training_set_kwargs.anamorphic))
+
+        # Surface errors from the image saver, waiting for it at the end.
+        if image_saver is not None:
+            for future in [future for future in image_futures if done or future.done()]:
+                future.result()
+                image_futures.remove(future)
+
+        for run in runs:
+
+            # Save network snapshot.
+            snapshot_pkl = None
+            snapshot_data = None
+            if (network_snapshot_ticks is not None) and (done or cur_tick % network_snapshot_ticks == 0):
+                with wall_timers('network_snapshot'):
+                    snapshot_data = dict(G=run.G, D=run.D, G_ema=run.G_ema, augment_pipe=run.augment_pipe, training_set_kwargs=dict(training_set_kwargs))
+                    for key, value in snapshot_data.items():
+                        if isinstance(value, torch.nn.Module):
+                            value = copy.deepcopy(value).eval().requires_grad_(False)
+                            if num_gpus > 1:
+                                misc.check_ddp_consistency(value, ignore_regex=r'.*\.[^.]+_(avg|ema)')
+                                for param in misc.params_and_buffers(value):
+                                    torch.distributed.broadcast(param, src=0)
+                            snapshot_data[key] = value.cpu()
+                        del value # conserve memory
+                    snapshot_pkl = os.path.join(run.run_dir, f'network-snapshot-{cur_nimg//1000:06d}.pkl')
+                    if rank == 0:
+                        with open(snapshot_pkl, 'wb') as f:
+                            pickle.dump(snapshot_data, f)
+
+            # Evaluate metrics.
+            with wall_timers('metrics'):
+                if (snapshot_data is not None) and (len(metrics) > 0) and metrics_async:
+                    if rank == 0:
+                        stats_worker.submit(snapshot_pkl)
+                elif (snapshot_data is not None) and (len(metrics) > 0):
+                    if rank == 0:
+                        print('Evaluating metrics' + (f' for run {run.idx}' if packed_runs is not None else '') + '...')
+                    for result_dict in metric_main.calc_metrics(metrics=metrics, G=snapshot_data['G_ema'],
+                        dataset_kwargs=training_set_kwargs, num_gpus=num_gpus, rank=rank, device=device):
+                        if rank == 0:
+                            metric_main.report_metric(result_dict, run_dir=run.run_dir, snapshot_pkl=snapshot_pkl)
+                        run.stats_metrics.update(result_dict.results)
+            del snapshot_data # conserve memory
 
         # Collect statistics.
+        wall_timers.report()
         for phase in phases:
             value = []
             if (phase.start_event is not None) and (phase.end_event is not None):
                 phase.end_event.synchronize()
                 value = phase.start_event.elapsed_time(phase.end_event)
-            training_stats.report0('Timing/' + phase.name, value)
+            with training_stats.name_prefix(phase.run.prefix):
+                training_stats.report0('Timing/' + phase.name, value)
         stats_collector.update()
         stats_dict = stats_collector.as_dict()
+        if stats_worker is not None:
+            for _snapshot_pkl, results in (stats_worker.close() if done else stats_worker.poll()):
+                runs[0].stats_metrics.update(results if results is not None else {})
 
         # Update logs.
         timestamp = time.time()
-        if stats_jsonl is not None:
-            fields = dict(stats_dict, timestamp=timestamp)
-            stats_jsonl.write(json.dumps(fields) + '\n')
-            stats_jsonl.flush()
-        if stats_tfevents is not None:
-            global_step = int(cur_nimg / 1e3)
-            walltime = timestamp - start_time
-            for name, value in stats_dict.items():
-                stats_tfevents.add_scalar(name, value.mean, global_step=global_step, walltime=walltime)
-            for name, value in stats_metrics.items():
-                stats_tfevents.add_scalar(f'Metrics/{name}', value, global_step=global_step, walltime=walltime)
-            stats_tfevents.flush()
+        for run in runs:
+            run_stats = get_packed_run_stats(stats_dict, run, runs)
+            if run.stats_jsonl is not None:
+                fields = dict(run_stats, timestamp=timestamp)
+                run.stats_jsonl.write(json.dumps(fields) + '\n')
+                run.stats_jsonl.flush()
+            if run.stats_tfevents is not None:
+                global_step = int(cur_nimg / 1e3)
+                walltime = timestamp - start_time
+                for name, value in run_stats.items():
+                    run.stats_tfevents.add_scalar(name, value.mean, global_step=global_step, walltime=walltime)
+                for name, value in run.stats_metrics.items():
+                    run.stats_tfevents.add_scalar(f'Metrics/{name}', value, global_step=global_step, walltime=walltime)
+                run.stats_tfevents.flush()
+        if stats_endpoint is not None:
+            stats_endpoint.update(stats_dict, metrics={run.prefix + name: value for run in runs for name, value in run.stats_metrics.items()}, timestamp=timestamp)
         if progress_fn is not None:
             progress_fn(cur_nimg // 1000, total_kimg)
 
@@ -458,6 +789,13 @@ def training_loop(
             break
 
     # Done.
+    wall_timers.close()
+    if stats_endpoint is not None:
+        stats_endpoint.close()
+    if profiler_windows is not None:
+        profiler_windows.close()
+    if image_saver is not None:
+        image_saver.shutdown(wait=True)
     if rank == 0:
         print()
         print('Exiting...')